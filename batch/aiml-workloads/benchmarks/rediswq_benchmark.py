@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Throughput benchmark for rediswq.RedisWQ.
+#
+# Starts a local redis-server, fills a queue from N producer processes, drains
+# it with M consumer processes going through lease/complete cycles, and
+# reports for each queue mode:
+#   - items/sec for producers and consumers
+#   - p50/p99 latency of the lease calls
+#   - Redis commands sent per item by the consumers
+#
+# When redis-server is not installed, an in-process fakeredis server stands
+# in for it and the producers and consumers run as threads instead. Those
+# numbers are only comparable with each other. With --port, an existing
+# server is used instead, and only the keys of the "benchmark" queue are
+# deleted from it, never the rest of its data.
+#
+#   python rediswq_benchmark.py --items 20000 --producers 2 --consumers 8
+
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import rediswq  # noqa: E402
+
+QUEUE_NAME = "benchmark"
+
+# (layout, weighted) of each queue mode
+MODES = {
+    "list": (rediswq.LAYOUT_LIST, False),
+    "zset": (rediswq.LAYOUT_ZSET, False),
+    "list-weighted": (rediswq.LAYOUT_LIST, True),
+    "zset-weighted": (rediswq.LAYOUT_ZSET, True),
+}
+
+
+def free_port():
+    """Return a TCP port that is free on localhost."""
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_server():
+    """Start a local Redis server.
+
+    Returns the connection parameters of the server, and a function
+    stopping it."""
+    if not shutil.which("redis-server"):
+        import fakeredis
+        print("redis-server not found, using fakeredis with threads")
+        server = fakeredis.FakeServer()
+        return ({"connection_class": fakeredis.FakeConnection,
+                 "server": server},
+                lambda: None)
+    port = free_port()
+    server = subprocess.Popen(
+        ["redis-server", "--port", str(port), "--save", "",
+         "--appendonly", "no", "--notify-keyspace-events", "Klz"],
+        stdout=subprocess.DEVNULL)
+    print("Using redis-server on port {}".format(port))
+    db = redis.StrictRedis(port=port)
+    for _ in range(50):
+        try:
+            db.ping()
+            return {"port": port}, server.terminate
+        except redis.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("redis-server did not start")
+
+
+def connect(server):
+    """Return the redis_kwargs of a RedisWQ connecting to 'server'."""
+    if "connection_class" in server:
+        return {"connection_pool": redis.ConnectionPool(**server)}
+    return server
+
+
+# Commands sent by the Redis clients of this process, once count_commands()
+# is called.
+counter = {"commands": 0}
+
+
+def count_commands():
+    """Count the commands sent by this process's Redis clients in counter.
+
+    EVALSHA counts as one command, as it does for the server."""
+    if getattr(redis.StrictRedis.execute_command, "counted", False):
+        return
+    execute_command = redis.StrictRedis.execute_command
+    pipeline_execute = redis.client.Pipeline.execute
+
+    def counted_execute_command(self, *args, **options):
+        counter["commands"] += 1
+        return execute_command(self, *args, **options)
+
+    def counted_pipeline_execute(self, *args, **kwargs):
+        counter["commands"] += len(self.command_stack)
+        return pipeline_execute(self, *args, **kwargs)
+
+    counted_execute_command.counted = True
+    redis.StrictRedis.execute_command = counted_execute_command
+    redis.client.Pipeline.execute = counted_pipeline_execute
+
+
+def produce(server, mode, items, results):
+    """Enqueue 'items', 100 per round-trip."""
+    commands = counter["commands"]
+    layout, weighted = MODES[mode]
+    q = rediswq.RedisWQ(
+        name=QUEUE_NAME, layout=layout, weighted=weighted, **connect(server))
+    for i in range(0, len(items), 100):
+        batch = items[i:i + 100]
+        q.enqueue_many(batch, [len(item) for item in batch])
+    results.put((len(items), [], counter["commands"] - commands))
+
+
+def consume(server, mode, batch_size, results):
+    """Lease and complete items until the queue is drained."""
+    count_commands()
+    commands = counter["commands"]
+    layout, weighted = MODES[mode]
+    q = rediswq.RedisWQ(
+        name=QUEUE_NAME, layout=layout, weighted=weighted, **connect(server))
+    latencies = []
+    completed = 0
+    while q.wait():
+        start = time.perf_counter()
+        if batch_size > 1:
+            items = q.lease_many(batch_size, lease_secs=60, block=False)
+        else:
+            item = q.lease(lease_secs=60, block=False)
+            items = [item] if item else []
+        latencies.append(time.perf_counter() - start)
+        if batch_size > 1:
+            q.complete_many(items)
+        elif items:
+            q.complete(items[0])
+        completed += len(items)
+    results.put((completed, latencies, counter["commands"] - commands))
+
+
+def run_workers(target, args_list, threads):
+    """Run target(*args, results) for each args, in parallel.
+
+    Returns the elapsed time, the (items, latencies) of each worker and the
+    number of Redis commands they sent."""
+    if threads:
+        results = queue.Queue()
+        workers = [threading.Thread(target=target, args=args + (results,))
+                   for args in args_list]
+    else:
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=target, args=args + (results,))
+            for args in args_list
+        ]
+    commands = counter["commands"]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    collected = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    if threads:
+        # The threads share this process's counter.
+        commands = counter["commands"] - commands
+    else:
+        commands = sum(c[2] for c in collected)
+    return elapsed, [c[:2] for c in collected], commands
+
+
+def clear_queue(db):
+    """Delete the keys of the benchmark queue, and only those, so that the
+    benchmark can run against a Redis server that holds other data."""
+    keys = [QUEUE_NAME] + list(db.scan_iter(match=QUEUE_NAME + ":*"))
+    for i in range(0, len(keys), 1000):
+        db.delete(*keys[i:i + 1000])
+
+
+def percentile(values, q):
+    """Return the q-th percentile of 'values'."""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def benchmark(server, mode, args, started):
+    """Benchmark one queue mode and print its results.
+
+    Only a server started by the benchmark itself is flushed; otherwise
+    just the keys of the benchmark queue are deleted."""
+    threads = "connection_class" in server
+    db = redis.StrictRedis(**connect(server))
+    if started:
+        db.flushall()
+    else:
+        clear_queue(db)
+    items = ["datasets/training/{:08d}.pkl".format(i)
+             for i in range(args.items)]
+    chunks = [items[i::args.producers] for i in range(args.producers)]
+    elapsed, _, _ = run_workers(
+        produce, [(server, mode, chunk) for chunk in chunks], threads)
+    produce_rate = args.items / elapsed
+
+    elapsed, collected, commands = run_workers(
+        consume,
+        [(server, mode, args.batch_size) for _ in range(args.consumers)],
+        threads)
+    completed = sum(c[0] for c in collected)
+    latencies = [latency for c in collected for latency in c[1]]
+    print("{:<14} {:>10.0f} {:>10.0f} {:>9.2f} {:>9.2f} {:>9.2f}{}".format(
+        mode,
+        produce_rate,
+        completed / elapsed,
+        percentile(latencies, 50) * 1000,
+        percentile(latencies, 99) * 1000,
+        commands / max(completed, 1),
+        "" if completed == args.items else
+        "  (completed {} of {})".format(completed, args.items),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure RedisWQ throughput against a local Redis.")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--producers", type=int, default=2)
+    parser.add_argument("--consumers", type=int, default=4)
+    parser.add_argument(
+        "--batch-size", type=int, default=1,
+        help="items per lease; above 1, lease_many/complete_many are used")
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument(
+        "--port", type=int,
+        help="use the Redis server already listening on this port; only "
+             "the keys of the \"{}\" queue are deleted".format(QUEUE_NAME))
+    args = parser.parse_args()
+
+    if args.port:
+        server, stop = {"port": args.port}, lambda: None
+    else:
+        server, stop = start_server()
+    count_commands()
+    try:
+        print("{} items, {} producers, {} consumers, batch size {}".format(
+            args.items, args.producers, args.consumers, args.batch_size))
+        print("{:<14} {:>10} {:>10} {:>9} {:>9} {:>9}".format(
+            "mode", "enqueue/s", "items/s", "p50 ms", "p99 ms", "cmds/item"))
+        for mode in args.modes:
+            benchmark(server, mode, args, started=not args.port)
+        if args.port:
+            clear_queue(redis.StrictRedis(**connect(server)))
+    finally:
+        stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -17,17 +17,28 @@ echo "**************************************"
 echo "Populating queue for batch training..."
 echo "**************************************"
 echo "The following datasets will be queued for processing:"
-filenames=""
+entries=""
+weights=""
 
 # Report all the files containing the training datasets
-# and create a concatenated string of filenames to add to the Redis queue
-for filepath in datasets/training/*.pkl; do
-  echo $filepath
-  filenames+=" $filepath"
+# and create a concatenated string of "size filename" pairs to add to the
+# Redis queue. The queue is a sorted set scored by size, so that workers
+# start with the largest datasets. The workers read the Parquet copies
+# written by transfer-datasets.sh, which are streamed in chunks.
+for pickle_path in datasets/training/*.pkl; do
+  size=$(wc -c < "$pickle_path" | tr -d ' ')
+  filepath="${pickle_path%.pkl}.parquet"
+  echo "$filepath ($size bytes as Pickle)"
+  entries="$entries $size $filepath"
+  weights="$weights $filepath $size"
 done
 
-# Push filenames to a Redis queue running on the `redis-leader` GKE Pod
-QUEUE_LENGTH=$(kubectl exec redis-leader -- /bin/sh -c \
-  "redis-cli rpush datasets ${filenames}")
+# Push filenames to a Redis queue running on the `redis-leader` GKE Pod.
+# The sizes are also kept in datasets:weights, to requeue the datasets of
+# crashed workers with the same score.
+QUEUE_LENGTH=$(kubectl exec redis-leader -c leader -- /bin/sh -c \
+  "redis-cli hset datasets:weights ${weights} > /dev/null && \
+   redis-cli zadd datasets ${entries} > /dev/null && \
+   redis-cli zcard datasets")
 
 echo "Queue length: ${QUEUE_LENGTH}"
@@ -15,4 +15,11 @@
 
 # Copy files containing training datasets from code repository to the GKE Pod
 echo "Copying datasets to Pod 'redis-leader'..."
-kubectl cp datasets redis-leader:/mnt/fileserver
+kubectl cp -c leader datasets redis-leader:/mnt/fileserver
+
+# Convert the Pickle datasets to Parquet, which the workers stream into the
+# model in chunks instead of loading whole. The conversion runs in the
+# lease-reaper container, which has the workload image.
+echo "Converting datasets to Parquet..."
+kubectl exec redis-leader -c lease-reaper -- \
+  python /convert_datasets.py /mnt/fileserver/datasets
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compact checkpoints of the fraud detection model.
+#
+# A checkpoint only holds the learned state of the SGDClassifier, as NumPy
+# arrays in an .npz file, rather than a pickle of the whole estimator.
+# Checkpoints and the "latest" pointer next to them are written to a
+# temporary file and renamed into place, so that workers sharing the file
+# server never read a partially written file.
+
+import os
+import pickle
+import tempfile
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+
+# Name of the file, in the checkpoint directory, holding the filename of the
+# newest checkpoint
+LATEST_FILENAME = "LATEST"
+
+
+def _atomic_write(path, write):
+    """
+    Calls write(f) with a temporary file in the directory of path, then
+    renames the temporary file to path.
+    The rename replaces path in one step, so readers see either the previous
+    file or the complete new one.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory,
+        prefix="." + os.path.basename(path) + ".",
+        suffix=".tmp"
+    )
+    try:
+        # mkstemp creates files readable by their owner only
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_state(model):
+    """
+    Returns the learned state of a fitted SGDClassifier, as a dict of
+    NumPy arrays.
+    """
+    state = {
+        "coef": model.coef_,
+        "intercept": model.intercept_,
+        "classes": model.classes_,
+        "t": np.array(model.t_),
+        "n_features_in": np.array(model.n_features_in_),
+    }
+    if hasattr(model, "feature_names_in_"):
+        state["feature_names_in"] = model.feature_names_in_.astype(str)
+    return state
+
+
+def from_state(state):
+    """
+    Returns an SGDClassifier with the learned state returned by get_state,
+    ready to be trained further with partial_fit.
+    """
+    model = SGDClassifier(warm_start=True)
+    model.coef_ = state["coef"]
+    model.intercept_ = state["intercept"]
+    model.classes_ = state["classes"]
+    model.t_ = float(state["t"])
+    model.n_features_in_ = int(state["n_features_in"])
+    if "feature_names_in" in state:
+        model.feature_names_in_ = state["feature_names_in"].astype(object)
+    return model
+
+
+def save_checkpoint(model, path):
+    """
+    Saves the learned state of a fitted SGDClassifier to the .npz file
+    at path.
+    """
+    state = get_state(model)
+    _atomic_write(path, lambda f: np.savez(f, **state))
+
+
+def load_checkpoint(path):
+    """
+    Returns an SGDClassifier restored from the checkpoint at path, ready to
+    be trained further with partial_fit.
+    Checkpoints pickled by earlier versions of the trainer (.pkl) are
+    loaded as well.
+    """
+    if path.endswith(".pkl"):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    with np.load(path, allow_pickle=False) as state:
+        return from_state(state)
+
+
+def publish_latest(checkpoint_dir, path):
+    """
+    Points the "latest" pointer of checkpoint_dir at the checkpoint at path,
+    which must be in checkpoint_dir.
+    """
+    filename = os.path.basename(path).encode("utf-8")
+    _atomic_write(
+        os.path.join(checkpoint_dir, LATEST_FILENAME),
+        lambda f: f.write(filename)
+    )
+
+
+def latest_checkpoint(checkpoint_dir):
+    """
+    Returns the filepath of the newest checkpoint published in
+    checkpoint_dir, or None if there is none yet.
+    """
+    try:
+        with open(os.path.join(checkpoint_dir, LATEST_FILENAME), 'rb') as f:
+            filename = f.read().decode("utf-8").strip()
+    except FileNotFoundError:
+        return None
+    if not filename:
+        return None
+    return os.path.join(checkpoint_dir, filename)
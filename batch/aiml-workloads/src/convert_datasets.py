@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Converts the Pickle datasets (.pkl) of a directory tree to Parquet, or
+# to Feather with --format feather.
+#
+# Pickle files can only be loaded whole, so the workers cannot stream them
+# into the model chunk by chunk. The converted files are written next to
+# the Pickle files, in row groups (Parquet) or record batches (Feather) of
+# CHUNK_SIZE rows, which the workers read one at a time:
+#
+#   python convert_datasets.py /mnt/fileserver/datasets
+
+import argparse
+import os
+
+import pandas as pd
+
+# Rows per Parquet row group or Feather record batch; the chunk size of the
+# workers
+CHUNK_SIZE = 50000
+
+FORMATS = ("parquet", "feather")
+
+
+def convert(pickle_path, row_group_size=CHUNK_SIZE, format="parquet"):
+    """
+    Writes the dataset of pickle_path to a Parquet or Feather file with the
+    same name, and returns its path. The file is written under a temporary
+    name and then renamed, so that a worker never reads a partial file.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown dataset format: {}".format(format))
+    path = os.path.splitext(pickle_path)[0] + "." + format
+    tmp_path = path + ".tmp"
+    dataset = pd.read_pickle(pickle_path)
+    # The index is not a feature, and is not read back by the workers
+    if format == "feather":
+        # Each compressed record batch is decompressed whole when read, so
+        # their size is bounded like that of the Parquet row groups.
+        dataset.reset_index(drop=True).to_feather(
+            tmp_path, chunksize=row_group_size)
+    else:
+        dataset.to_parquet(
+            tmp_path, index=False, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert Pickle datasets to Parquet or Feather.")
+    parser.add_argument("directory")
+    parser.add_argument("--row-group-size", type=int, default=CHUNK_SIZE,
+                        help="rows per row group or record batch")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    args = parser.parse_args()
+
+    for root, _, filenames in os.walk(args.directory):
+        for filename in sorted(filenames):
+            if filename.endswith(".pkl"):
+                path = convert(os.path.join(root, filename),
+                               args.row_group_size, args.format)
+                print("Converted " + path)
+
+
+if __name__ == "__main__":
+    main()
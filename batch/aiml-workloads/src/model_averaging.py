@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Parameter averaging of the models trained by parallel workers.
+#
+# Each worker trains on its datasets starting from the latest shared
+# checkpoint, and publishes the change it made to the model parameters
+# through the Redis instance of the work queue. Once enough updates are
+# pending, the worker publishing the last one averages them, weighted by
+# the number of rows each was trained on, applies the average to the shared
+# model, and saves it as the new latest checkpoint.
+#
+# The shared model is also kept in Redis, and updated there under a lock.
+# The checkpoints are read and written on the file server outside of the
+# lock, so slow file server I/O cannot outlast the lock and let two
+# workers average their updates into the same model.
+
+import io
+import os
+
+import numpy as np
+
+import checkpoints
+
+# Arrays of an update which are averaged into the shared model
+_AVERAGED = ("coef", "intercept", "t")
+
+
+class ModelAverager(object):
+    """
+    Averages the updates of the workers of a RedisWQ into the shared model
+    checkpoint of checkpoint_dir, every mix_every updates.
+    """
+    def __init__(self, queue, checkpoint_dir, mix_every=4, lock_timeout=60):
+        self._db = queue.db
+        self._checkpoint_dir = checkpoint_dir
+        self._mix_every = mix_every
+        self._lock_timeout = lock_timeout
+        self._updates_key = queue.key("model_updates")
+        self._version_key = queue.key("model_version")
+        self._model_key = queue.key("model_state")
+        self._lock_key = queue.key("model_lock")
+
+    def publish(self, base_path, model, weight):
+        """
+        Publishes the change made to the parameters of the checkpoint at
+        base_path (None for a new model) by training model on weight rows.
+        Averages the pending updates if there are enough of them, and then
+        returns the filepath of the new checkpoint. Otherwise returns None.
+        """
+        state = checkpoints.get_state(model)
+        if base_path:
+            base = checkpoints.get_state(
+                checkpoints.load_checkpoint(base_path)
+            )
+            for key in _AVERAGED:
+                state[key] = state[key] - base[key]
+        else:
+            state["t"] = state["t"] - 1.0   # the initial t_ of SGDClassifier
+        state["weight"] = np.array(float(weight))
+        pending = self._db.rpush(self._updates_key, _dumps(state))
+        if pending >= self._mix_every:
+            return self.reduce()
+        return None
+
+    def reduce(self):
+        """
+        Averages all the pending updates into the shared model.
+        Returns the filepath of the new checkpoint, or None if no update was
+        pending.
+        """
+        # Until the first averaging, the shared model is the latest
+        # checkpoint, e.g. of an earlier run. It is read before taking the
+        # lock.
+        base = None
+        if not self._db.exists(self._model_key):
+            base_path = checkpoints.latest_checkpoint(self._checkpoint_dir)
+            if base_path:
+                base = checkpoints.get_state(
+                    checkpoints.load_checkpoint(base_path)
+                )
+
+        # Only one worker at a time applies updates, so that two averaged
+        # models are not both derived from the same shared model.
+        with self._db.lock(self._lock_key, timeout=self._lock_timeout):
+            pipe = self._db.pipeline(transaction=True)
+            pipe.lrange(self._updates_key, 0, -1)
+            pipe.delete(self._updates_key)
+            pipe.get(self._model_key)
+            updates, _, shared = pipe.execute()
+            if not updates:
+                return None
+
+            states = [_loads(update) for update in updates]
+            if shared:
+                state = _loads(shared)
+            elif base:
+                state = base
+            else:
+                state = dict(states[0])
+                state.pop("weight")
+                state.update(coef=0.0, intercept=0.0, t=1.0)
+            weights = np.array([float(s["weight"]) for s in states])
+            weights /= weights.sum() or 1.0
+            for key in _AVERAGED:
+                mean = sum(w * s[key] for w, s in zip(weights, states))
+                state[key] = state[key] + mean
+
+            pipe = self._db.pipeline(transaction=True)
+            pipe.set(self._model_key, _dumps(state))
+            pipe.incr(self._version_key)
+            version = pipe.execute()[1]
+
+        path = os.path.join(
+            self._checkpoint_dir, "model_avg_{:06d}.npz".format(version)
+        )
+        checkpoints.save_checkpoint(checkpoints.from_state(state), path)
+        # A worker that was slower to save an older version leaves the
+        # pointer at the newer one.
+        if int(self._db.get(self._version_key)) == version:
+            checkpoints.publish_latest(self._checkpoint_dir, path)
+        print("Averaged {} model updates into {}".format(len(updates), path))
+        return path
+
+
+def _dumps(state):
+    """
+    Returns the dict of NumPy arrays state serialized as an .npz file.
+    """
+    buf = io.BytesIO()
+    np.savez(buf, **state)
+    return buf.getvalue()
+
+
+def _loads(data):
+    """
+    Returns the dict of NumPy arrays serialized by _dumps.
+    """
+    return dict(np.load(io.BytesIO(data), allow_pickle=False))
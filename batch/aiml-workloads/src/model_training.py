@@ -17,9 +17,87 @@ from pathlib import Path
 import pandas as pd
 import os
 import datetime
-import pickle
+import functools
+import time
+import numpy as np
 from sklearn.linear_model import SGDClassifier
-from sklearn.metrics import accuracy_score
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+
+import checkpoints
+
+
+def _load_dataset(dataset_path):
+    """
+    Deserializes the dataset at dataset_path into a pandas.DataFrame.
+
+    Pickle files are read with pandas. Columnar Parquet and Feather files
+    are read with Arrow and memory-mapped, which avoids most of the
+    deserialization work.
+    """
+    suffix = Path(dataset_path).suffix
+    if suffix == ".parquet":
+        return pd.read_parquet(dataset_path, memory_map=True)
+    if suffix in (".feather", ".arrow"):
+        import pyarrow.feather as feather
+        return feather.read_table(dataset_path, memory_map=True).to_pandas()
+    return pd.read_pickle(dataset_path)
+
+
+def _iter_dataset_chunks(dataset_path, chunk_size):
+    """
+    Yields the dataset at dataset_path as pandas.DataFrames of at most
+    chunk_size rows.
+
+    Parquet and Feather files are read one record batch at a time, so only
+    one batch is held in memory. Feather files are compressed by default,
+    so their batches are decompressed one at a time rather than mapped:
+    write them with a bounded chunksize, as convert_datasets.py does.
+    Pickle files cannot be read partially: they are loaded whole and then
+    sliced.
+    """
+    suffix = Path(dataset_path).suffix
+    if suffix == ".parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(dataset_path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif suffix in (".feather", ".arrow"):
+        import pyarrow as pa
+        with pa.memory_map(dataset_path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for start in range(0, batch.num_rows, chunk_size):
+                    yield batch.slice(start, chunk_size).to_pandas()
+    else:
+        dataset = pd.read_pickle(dataset_path)
+        for start in range(0, len(dataset), chunk_size):
+            yield dataset.iloc[start:start + chunk_size]
+
+
+@functools.lru_cache(maxsize=1)
+def _load_cached_dataset(dataset_path, mtime_ns):
+    """
+    Same as _load_dataset, but keeps the last dataset in memory for as long
+    as the file is not modified, so that the test dataset is only read from
+    the file server once per worker process.
+    """
+    return _load_dataset(dataset_path)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_cached_matrix(dataset_path, mtime_ns, label):
+    """
+    Same as _load_cached_dataset, but returns the features of the dataset
+    as a contiguous float32 matrix, and its labels as an array.
+    Only the matrix is kept in memory, not the DataFrame.
+    """
+    dataset = _load_dataset(dataset_path)
+    features = np.ascontiguousarray(
+        dataset.drop(columns=label, axis=1).to_numpy(dtype=np.float32)
+    )
+    labels = dataset[label].to_numpy()
+    return features, labels
 
 
 class FraudDetectionModelTrainer:
@@ -35,7 +113,10 @@ class FraudDetectionModelTrainer:
         train_dataset_path,
         test_dataset_path,
         label,
-        checkpoint_path=None
+        checkpoint_path=None,
+        chunk_size=None,
+        incremental_eval=False,
+        train_sample_size=10000
     ):
         # self._classes define the possible labels the model can expect to
         # encounter as it evaluates partial fitting with each batch of new data.
@@ -45,13 +126,29 @@ class FraudDetectionModelTrainer:
         self._train_dataset_path = train_dataset_path
         self._test_dataset_path = test_dataset_path
         self._label = label
+        # The training dataset is read once, and shared by train_and_save
+        # and generate_report.
+        self._train_dataset = None
+        # If a chunk size is provided, train_and_save streams the training
+        # dataset in chunks of that many rows instead of loading it whole,
+        # and measures the progressive validation accuracy in the same pass.
+        self._chunk_size = chunk_size
+        self._train_accuracy = None
+        # Number of rows the model was trained on by train_and_save
+        self._train_samples = 0
+        # In incremental evaluation mode, generate_report scores the cached
+        # test matrix with a single matrix product, and measures the
+        # training accuracy on a sample of at most train_sample_size rows.
+        self._incremental_eval = incremental_eval
+        self._train_sample_size = train_sample_size
+        # Seconds spent in each stage, reported by generate_report
+        self._timings = {}
 
         # If a filepath to a model checkpoint is provided, load the model with
         # the parameters from the checkpoint.
         # Otherwise, instantiate a new model.
         if checkpoint_path:
-            with open(checkpoint_path, 'rb') as f:
-                self._model = pickle.load(f)
+            self._model = checkpoints.load_checkpoint(checkpoint_path)
         else:
             self._model = SGDClassifier(warm_start=True)
 
@@ -70,6 +167,49 @@ class FraudDetectionModelTrainer:
 
         return features, labels
 
+    def get_train_samples(self):
+        """
+        Return the number of rows the model was trained on by
+        train_and_save.
+        """
+        return self._train_samples
+
+    def get_timings(self):
+        """
+        Return the seconds spent in each stage of training and reporting.
+        """
+        return dict(self._timings)
+
+    def _record_timing(self, stage, start):
+        """
+        Adds the seconds elapsed since start to the timing of stage.
+        """
+        elapsed = time.perf_counter() - start
+        self._timings[stage] = self._timings.get(stage, 0.0) + elapsed
+
+    def _predict_matrix(self, features):
+        """
+        Predicts the labels of a float32 feature matrix with one matrix
+        product, instead of going through the estimator's input validation.
+        """
+        coef = self._model.coef_.astype(np.float32, copy=False)
+        intercept = self._model.intercept_.astype(np.float32, copy=False)
+        scores = features @ coef.T + intercept
+        if scores.shape[1] == 1:
+            return self._model.classes_[(scores[:, 0] > 0).astype(int)]
+        return self._model.classes_[scores.argmax(axis=1)]
+
+    def _sample_train_matrix(self):
+        """
+        Returns the features and labels of at most train_sample_size rows
+        of the training dataset, as a float32 matrix and an array.
+        """
+        dataset = self._read_train_dataset()
+        if len(dataset) > self._train_sample_size:
+            dataset = dataset.sample(n=self._train_sample_size, random_state=0)
+        features, labels = self.get_features_and_labels(dataset)
+        return features.to_numpy(dtype=np.float32), labels.to_numpy()
+
     def get_model_accuracy(self, features, labels):
         """
         Accepts a dataset to partially train the model and returns a
@@ -83,23 +223,57 @@ class FraudDetectionModelTrainer:
         """
         Accepts a filepath containing the dataset and
         returns the deserializes pandas.DataFrame.
+        Supports Pickle (.pkl), Parquet (.parquet) and Feather (.feather)
+        files.
         """
-        dataset = pd.read_pickle(dataset_path)
+        dataset = _load_dataset(dataset_path)
         return dataset
 
+    def _read_train_dataset(self):
+        """
+        Returns the training dataset, reading it on first use only.
+        """
+        if self._train_dataset is None:
+            self._train_dataset = self._read_dataset(self._train_dataset_path)
+        return self._train_dataset
+
+    def _read_test_dataset(self):
+        """
+        Returns the test dataset, which is cached across trainers of the
+        same process. The returned DataFrame must not be modified.
+        """
+        return _load_cached_dataset(
+            self._test_dataset_path,
+            os.stat(self._test_dataset_path).st_mtime_ns
+        )
+
+    def _read_test_matrix(self):
+        """
+        Returns the features of the test dataset as a float32 matrix, and
+        its labels, cached across trainers of the same process.
+        The returned arrays must not be modified.
+        """
+        return _load_cached_matrix(
+            self._test_dataset_path,
+            os.stat(self._test_dataset_path).st_mtime_ns,
+            self._label
+        )
+
     def _get_checkpoint_name(self):
         """
         Returns a filename for the model checkpoint.
         """
         dataset_basename = Path(self._train_dataset_path).resolve().stem
-        filename = "model_cpt_{}.pkl".format(dataset_basename)
+        filename = "model_cpt_{}.npz".format(dataset_basename)
         return filename
 
-    def _save_model(self, checkpoint_dir):
+    def _save_model(self, checkpoint_dir, publish=True):
         """
         Accepts a directory path and returns the filepath where
         the checkpoint for the model is saved.
-        Creates the destination directory if it does not exist.
+        Creates the destination directory if it does not exist, and unless
+        publish is False, points the "latest" pointer of the directory at
+        the new checkpoint.
         """
         # Check whether the specified path exists or not
         isExist = os.path.exists(checkpoint_dir)
@@ -111,23 +285,73 @@ class FraudDetectionModelTrainer:
         filename = self._get_checkpoint_name()
         path = checkpoint_dir + filename
 
-        # Serialize the model checkpoint in to a Python Pickle file
-        with open(path, 'wb') as f:
-            pickle.dump(self._model, f)
+        # Save the model parameters, then publish them to the other workers
+        checkpoints.save_checkpoint(self._model, path)
+        if publish:
+            checkpoints.publish_latest(checkpoint_dir, path)
         return path
 
-    def train_and_save(self, checkpoint_dir):
+    def train_and_save(self, checkpoint_dir, publish=True):
         """
         Accepts a directory path.
         Returns the filepath where the model checkpoint is saved after being
         partially trained.
+        If publish is False, the checkpoint is saved but does not become the
+        latest checkpoint of the directory, e.g. when a ModelAverager
+        publishes the averaged models instead.
         """
-        dataset = self._read_dataset(self._train_dataset_path)
-        features, labels = self.get_features_and_labels(dataset)
-        self._model.partial_fit(features, labels, classes=self._classes)
-        checkpoint_path = self._save_model(checkpoint_dir)
+        if self._chunk_size:
+            self._train_in_chunks()
+        else:
+            start = time.perf_counter()
+            dataset = self._read_train_dataset()
+            self._record_timing("read_train", start)
+            start = time.perf_counter()
+            features, labels = self.get_features_and_labels(dataset)
+            self._model.partial_fit(features, labels, classes=self._classes)
+            self._train_samples = len(labels)
+            self._record_timing("train", start)
+        start = time.perf_counter()
+        checkpoint_path = self._save_model(checkpoint_dir, publish)
+        self._record_timing("save", start)
         return checkpoint_path
 
+    def _train_in_chunks(self):
+        """
+        Partially trains the model on each chunk of the training dataset in
+        turn, so memory use does not grow with the size of the dataset.
+        Each chunk is scored before the model is trained on it (test, then
+        train), and the accuracy over the chunks is reported by
+        generate_report as the progressive validation accuracy. The first
+        chunk of a new model is not scored.
+        """
+        correct = 0
+        scored = 0
+        total = 0
+        chunks = _iter_dataset_chunks(
+            self._train_dataset_path, self._chunk_size
+        )
+        while True:
+            # Reading and training are interleaved, and timed separately
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self._record_timing("read_train", start)
+            if chunk is None:
+                break
+            features, labels = self.get_features_and_labels(chunk)
+            if hasattr(self._model, "coef_"):
+                start = time.perf_counter()
+                correct += (self._model.predict(features) == labels).sum()
+                scored += len(labels)
+                self._record_timing("evaluate", start)
+            start = time.perf_counter()
+            self._model.partial_fit(features, labels, classes=self._classes)
+            total += len(labels)
+            self._record_timing("train", start)
+        self._train_samples = total
+        if scored:
+            self._train_accuracy = correct / scored
+
     def generate_report(self, output_path):
         """
         Accepts a output filepath.
@@ -136,20 +360,59 @@ class FraudDetectionModelTrainer:
         generated_on = str(datetime.datetime.now())
         checkpoint_name = self._get_checkpoint_name()
         dataset_name = Path(self._train_dataset_path).resolve().name
-        train_features, train_labels = self.get_features_and_labels(
-            self._read_dataset(self._train_dataset_path)
-        )
-        test_features, test_lables = self.get_features_and_labels(
-            self._read_dataset(self._test_dataset_path)
+        start = time.perf_counter()
+        if self._incremental_eval:
+            test_features, test_lables = self._read_test_matrix()
+        else:
+            test_features, test_lables = self.get_features_and_labels(
+                self._read_test_dataset()
+            )
+        self._record_timing("read_test", start)
+
+        start = time.perf_counter()
+        # When training streamed the dataset, its progressive validation
+        # accuracy was measured in the same pass, so the dataset is not read
+        # again. It is not the final model's accuracy on the training data.
+        training_accuracy = self._train_accuracy
+        training_metric = "Accuracy on training data"
+        if training_accuracy is not None:
+            training_metric = "Progressive validation accuracy on training data"
+        elif self._incremental_eval:
+            train_features, train_labels = self._sample_train_matrix()
+            training_accuracy = np.mean(
+                self._predict_matrix(train_features) == train_labels
+            )
+        else:
+            train_features, train_labels = self.get_features_and_labels(
+                self._read_train_dataset()
+            )
+            training_accuracy = self.get_model_accuracy(
+                train_features,
+                train_labels
+            )
+        if self._incremental_eval:
+            test_prediction = self._predict_matrix(test_features)
+        else:
+            test_prediction = self._model.predict(test_features)
+        test_accuracy = accuracy_score(test_prediction, test_lables)
+        precision, recall, f1, support = precision_recall_fscore_support(
+            test_lables,
+            test_prediction,
+            labels=self._classes,
+            zero_division=0,
         )
-        training_accuracy = self.get_model_accuracy(
-            train_features,
-            train_labels
+        self._record_timing("evaluate", start)
+
+        class_metrics = "".join(
+            "  class {}: precision={:.4f} recall={:.4f} f1={:.4f} "
+            "support={}\n".format(*metrics)
+            for metrics in zip(self._classes, precision, recall, f1, support)
         )
-        test_accuracy = self.get_model_accuracy(
-            test_features,
-            test_lables,
+        timings = " ".join(
+            "{}={:.3f}".format(stage, seconds)
+            for stage, seconds in self._timings.items()
         )
+        start = time.perf_counter()
         with open(output_path, 'a') as f:
             report = (
                 "*****************************************************\n"
@@ -157,14 +420,21 @@ class FraudDetectionModelTrainer:
                 "Training dataset: {}\n"
                 "Model checkpoint: {}\n"
                 "---\n"
-                "Accuracy on training data: {}\n"
+                "{}: {}\n"
                 "Accuracy on testing data: {}\n"
+                "Metrics on testing data per class:\n"
+                "{}"
+                "Stage timings (seconds): {}\n"
                 "\n"
             ).format(
                 generated_on,
                 dataset_name,
                 checkpoint_name,
+                training_metric,
                 training_accuracy,
                 test_accuracy,
+                class_metrics,
+                timings,
             )
             f.writelines(report)
+        self._record_timing("write_report", start)
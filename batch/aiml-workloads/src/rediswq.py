@@ -16,27 +16,169 @@
 # Based on the Kubernetes.io tutorial
 # https://kubernetes.io/docs/tasks/job/fine-parallel-processing-work-queue/
 
+import argparse
+import contextlib
 import redis
+import threading
+import time
 import uuid
 import hashlib
 
-class RedisWQ(object):
-    """
-    Simple Finite Work Queue with Redis Backend
+# The scripts below take the main queue as KEYS[1] or KEYS[2]. With
+# weighted=True it is a sorted set scored by weight instead of a list, so
+# they are formatted with the commands for the main queue's type.
+# %(pop)s pops the next item off the main queue (KEYS[1]).
+_POP = {
+    False: "redis.call('RPOP', KEYS[1])",
+    True: "redis.call('ZPOPMAX', KEYS[1])[1]",
+}
+# %(requeue)s pushes 'item' back to the main queue (KEYS[1]) with the weight
+# it was enqueued with, which is kept in the weights hash (KEYS[3]).
+_REQUEUE = {
+    False: "redis.call('RPUSH', KEYS[1], item)",
+    True: "redis.call('ZADD', KEYS[1], "
+          "redis.call('HGET', KEYS[3], item) or 0, item)",
+}
 
-    The items in the work queue are assumed to have unique values.
+# Moves up to ARGV[1] items from the main queue (KEYS[1]) to the processing
+# queue (KEYS[2]) in a single round-trip and returns them in lease order.
+_LEASE_MANY_SCRIPT = """
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = %(pop)s
+    if not item then
+        break
+    end
+    redis.call('LPUSH', KEYS[2], item)
+    items[i] = item
+end
+return items
+"""
 
-    This object is not intended to be used by multiple threads
-    concurrently.
+# "zset" layout: moves up to ARGV[1] items from the main queue (KEYS[1]) to
+# the lease set (KEYS[2]), scored with their lease deadline (server time
+# plus ARGV[2] seconds), and returns them in lease order.
+_ZSET_LEASE_MANY_SCRIPT = """
+local now = redis.call('TIME')
+local deadline = tonumber(now[1]) + tonumber(now[2]) / 1000000 + tonumber(ARGV[2])
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = %(pop)s
+    if not item then
+        break
+    end
+    redis.call('ZADD', KEYS[2], deadline, item)
+    items[i] = item
+end
+return items
+"""
+
+# Removes the items in ARGV[2..] from the processing queue (KEYS[1]) and
+# the weights hash (KEYS[3]), and deletes their lease keys (KEYS[4..]).
+# Publishes "drained" on the events channel (ARGV[1]) once both the
+# processing and main (KEYS[2]) queues are empty.
+_COMPLETE_SCRIPT = """
+for i = 2, #ARGV do
+    redis.call('LREM', KEYS[1], 0, ARGV[i])
+    redis.call('HDEL', KEYS[3], ARGV[i])
+    redis.call('DEL', KEYS[i + 2])
+end
+if redis.call('EXISTS', KEYS[1], KEYS[2]) == 0 then
+    redis.call('PUBLISH', ARGV[1], 'drained')
+end
+return #ARGV - 1
+"""
+
+# "zset" layout: removes the items in ARGV[2..] from the lease set (KEYS[1])
+# and the weights hash (KEYS[3]). If the queue still has a processing list
+# from the "list" layout (KEYS[4]), the items and their lease keys (KEYS[5..])
+# are removed from it as well. Publishes "drained" on the events channel
+# (ARGV[1]) once nothing is leased and the main queue (KEYS[2]) is empty.
+_ZSET_COMPLETE_SCRIPT = """
+local legacy = #KEYS > 3 and redis.call('EXISTS', KEYS[4]) == 1
+for i = 2, #ARGV do
+    redis.call('ZREM', KEYS[1], ARGV[i])
+    redis.call('HDEL', KEYS[3], ARGV[i])
+    if legacy then
+        redis.call('LREM', KEYS[4], 0, ARGV[i])
+        redis.call('DEL', KEYS[i + 3])
+    end
+end
+if redis.call('EXISTS', KEYS[1], KEYS[2]) == 0 and
+        (not legacy or redis.call('EXISTS', KEYS[4]) == 0) then
+    redis.call('PUBLISH', ARGV[1], 'drained')
+end
+return #ARGV - 1
+"""
+
+# "zset" layout: returns up to ARGV[1] items whose lease deadline has passed
+# from the lease set (KEYS[2]) to the main queue (KEYS[1]), and publishes
+# "requeued" on the events channel (ARGV[2]) if there were any.
+_ZSET_REAP_SCRIPT = """
+local now = redis.call('TIME')
+local t = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local items = redis.call(
+    'ZRANGEBYSCORE', KEYS[2], '-inf', t, 'LIMIT', 0, tonumber(ARGV[1]))
+if #items > 0 then
+    redis.call('ZREM', KEYS[2], unpack(items))
+    for _, item in ipairs(items) do
+        %(requeue)s
+    end
+    redis.call('PUBLISH', ARGV[2], 'requeued')
+end
+return #items
+"""
+
+# "list" layout: returns the items in ARGV[2..] from the processing queue
+# (KEYS[2]) to the main queue (KEYS[1]), unless their lease key (KEYS[i + 2])
+# exists, and publishes "requeued" on the events channel (ARGV[1]) if there
+# were any.
+_LIST_REAP_SCRIPT = """
+local reaped = 0
+for i = 2, #ARGV do
+    local item = ARGV[i]
+    if redis.call('EXISTS', KEYS[i + 2]) == 0 and
+            redis.call('LREM', KEYS[2], 1, item) > 0 then
+        %(requeue)s
+        reaped = reaped + 1
+    end
+end
+if reaped > 0 then
+    redis.call('PUBLISH', ARGV[1], 'requeued')
+end
+return reaped
+"""
+
+# "zset" layout: moves the lease deadline of the item ARGV[2] in the lease set
+# (KEYS[1]) to ARGV[1] seconds from now, unless the item is no longer leased.
+_ZSET_RENEW_SCRIPT = """
+local now = redis.call('TIME')
+local deadline = tonumber(now[1]) + tonumber(now[2]) / 1000000 + tonumber(ARGV[1])
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', deadline, ARGV[2])
+"""
+
+LAYOUT_LIST = "list"
+LAYOUT_ZSET = "zset"
+
+
+class QueueTypeError(redis.ResponseError):
+    """
+    The main queue in Redis is not of the type the RedisWQ expects: a list,
+    or a sorted set with weighted=True.
     """
-    def __init__(self, name, **redis_kwargs):
-        """
-        The default connection parameters are:
-        host='localhost', port=6379, db=0
 
-        The work queue is identified by "name".
-        """
-        self._db = redis.StrictRedis(**redis_kwargs)
+
+class _RedisWQBase(object):
+    """
+    Key names, scripts and round-trip builders shared by RedisWQ and
+    AsyncRedisWQ.
+    """
+    def _setup(self, db, name, layout, compat, weighted):
+        """Set up the keys and scripts of the queue "name" on client 'db',
+        a redis or a redis.asyncio client."""
+        if layout not in (LAYOUT_LIST, LAYOUT_ZSET):
+            raise ValueError("Unknown RedisWQ layout: {}".format(layout))
+        self._db = db
         # The session ID will uniquely identify this "worker".
         self._session = str(uuid.uuid4())
         # Work queue is implemented as two queues: main, and processing.
@@ -45,19 +187,183 @@ class RedisWQ(object):
         self._main_q_key = name
         self._processing_q_key = name + ":processing"
         self._lease_key_prefix = name + ":leased_by_session:"
+        # With the "zset" layout, processing is a sorted set instead.
+        self._layout = layout
+        self._compat = compat
+        self._leased_set_key = name + ":leased"
+        # With weighted=True, main is a sorted set, and the weight of each
+        # item is also kept until it completes, to requeue it with.
+        self._weighted = weighted
+        self._weights_key = name + ":weights"
+        commands = {"pop": _POP[weighted], "requeue": _REQUEUE[weighted]}
+        if layout == LAYOUT_ZSET:
+            self._lease_many_script = self._db.register_script(
+                _ZSET_LEASE_MANY_SCRIPT % commands)
+            self._complete_script = self._db.register_script(
+                _ZSET_COMPLETE_SCRIPT)
+            self._reap_script = self._db.register_script(
+                _ZSET_REAP_SCRIPT % commands)
+            self._renew_script = self._db.register_script(_ZSET_RENEW_SCRIPT)
+        else:
+            self._lease_many_script = self._db.register_script(
+                _LEASE_MANY_SCRIPT % commands)
+            self._complete_script = self._db.register_script(_COMPLETE_SCRIPT)
+        self._list_reap_script = self._db.register_script(
+            _LIST_REAP_SCRIPT % commands)
+        # wait() listens for completions and reaps on the events channel,
+        # and for items pushed by other clients on the main queue's
+        # keyspace channel.
+        self._events_channel = name + ":events"
+        self._keyspace_channel = "__keyspace@{}__:{}".format(
+            self._db.connection_pool.connection_kwargs.get("db", 0), name)
 
     def sessionID(self):
         """Return the ID for this session."""
         return self._session
 
+    @property
+    def db(self):
+        """The Redis client of the queue, for state shared by its workers."""
+        return self._db
+
+    def key(self, suffix):
+        """Return the name of the Redis key 'suffix' of this queue, for
+        state shared by its workers, e.g. key("model_updates")."""
+        return self._main_q_key + ":" + suffix
+
+    @contextlib.contextmanager
+    def _main_q_type_checked(self):
+        """Raise a QueueTypeError instead of the WRONGTYPE error of a
+        command run on a main queue of the wrong type."""
+        try:
+            yield
+        except QueueTypeError:
+            raise
+        except redis.ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            expected, other = "a list", "a sorted set"
+            if self._weighted:
+                expected, other = other, expected
+            raise QueueTypeError(
+                "RedisWQ(weighted={}) expects the main queue {!r} to be {}. "
+                "Was it filled as {}? ({})".format(
+                    self._weighted, self._main_q_key, expected, other, e)
+            ) from e
+
+    def _itemkey(self, item):
+        """Returns a string that uniquely identifies an item (bytes)."""
+        return hashlib.sha224(item).hexdigest()
+
+    def _qsizes_pipeline(self):
+        """Return a pipeline that reads the size of the main queue, then of
+        each part of the processing queue."""
+        pipe = self._db.pipeline(transaction=False)
+        if self._weighted:
+            pipe.zcard(self._main_q_key)
+        else:
+            pipe.llen(self._main_q_key)
+        if self._layout == LAYOUT_ZSET:
+            pipe.zcard(self._leased_set_key)
+        if self._layout == LAYOUT_LIST or self._compat:
+            pipe.llen(self._processing_q_key)
+        return pipe
+
+    def _enqueue_pipeline(self, items, weights):
+        """Return a transaction that enqueues 'items'."""
+        pipe = self._db.pipeline(transaction=True)
+        if self._weighted:
+            if weights is None:
+                weights = [0] * len(items)
+            pipe.hset(self._weights_key, mapping=dict(zip(items, weights)))
+            pipe.zadd(self._main_q_key, dict(zip(items, weights)))
+        else:
+            pipe.rpush(self._main_q_key, *items)
+        pipe.publish(self._events_channel, "enqueued")
+        return pipe
+
+    def _complete_keys(self, values):
+        """Return the KEYS of the complete script for 'values'."""
+        if self._layout == LAYOUT_ZSET:
+            keys = [self._leased_set_key, self._main_q_key, self._weights_key]
+            if self._compat:
+                keys.append(self._processing_q_key)
+                keys += [self._lease_key_prefix + self._itemkey(value)
+                         for value in values]
+        else:
+            keys = [self._processing_q_key, self._main_q_key,
+                    self._weights_key]
+            keys += [self._lease_key_prefix + self._itemkey(value)
+                     for value in values]
+        return keys
+
+
+class RedisWQ(_RedisWQBase):
+    """
+    Simple Finite Work Queue with Redis Backend
+
+    The items in the work queue are assumed to have unique values.
+
+    This object is not intended to be used by multiple threads
+    concurrently.
+
+    Items being worked on are tracked with one of two layouts:
+
+    - "list" (the default): a processing list, plus one
+      "leased_by_session:" key per item that expires with the lease.
+      Completing an item scans the whole processing list.
+    - "zset": a sorted set of the leased items scored by their lease
+      deadline. Completing an item and looking up its lease are O(log N).
+
+    With compat=True (the default), the "zset" layout also reads and
+    completes items that are still in the processing list of a queue that
+    was created with the "list" layout.
+
+    With weighted=True, the main queue is a sorted set scored by a weight
+    given to each item by enqueue(), e.g. its size, and items are leased
+    heaviest first. Scheduling the longest work first keeps long items
+    from starting last and stretching the tail of the job. A blocking
+    lease on a weighted queue also returns nothing once the queue is
+    drained. Commands on a main queue of the other type, e.g. a list
+    filled with RPUSH read by a weighted queue, raise QueueTypeError.
+    """
+    def __init__(self, name, layout=LAYOUT_LIST, compat=True, weighted=False,
+                 **redis_kwargs):
+        """
+        The default connection parameters are:
+        host='localhost', port=6379, db=0
+
+        The work queue is identified by "name".
+        """
+        self._setup(redis.StrictRedis(**redis_kwargs),
+                    name, layout, compat, weighted)
+        # Processing list items seen without a lease by the last reap().
+        self._reap_candidates = set()
+        # Started by the first keep_alive().
+        self._renewer = None
+
     def _main_qsize(self):
         """Return the size of the main queue."""
+        if self._weighted:
+            return self._db.zcard(self._main_q_key)
         return self._db.llen(self._main_q_key)
 
     def _processing_qsize(self):
-        """Return the size of the main queue."""
+        """Return the size of the processing queue."""
+        if self._layout == LAYOUT_ZSET:
+            size = self._db.zcard(self._leased_set_key)
+            if self._compat:
+                size += self._db.llen(self._processing_q_key)
+            return size
         return self._db.llen(self._processing_q_key)
 
+    def _qsizes(self):
+        """Return the sizes of the main and processing queues, in one
+        round-trip."""
+        with self._main_q_type_checked():
+            main_size, *processing_sizes = self._qsizes_pipeline().execute()
+        return main_size, sum(processing_sizes)
+
     def empty(self):
         """Return True if the queue is empty, including work being done,
         False otherwise.
@@ -65,14 +371,76 @@ class RedisWQ(object):
         False does not necessarily mean that there is work available
         to work on right now,
         """
-        return self._main_qsize() == 0 and self._processing_qsize() == 0
+        return self._qsizes() == (0, 0)
 
-    def _itemkey(self, item):
-        """Returns a string that uniquely identifies an item (bytes)."""
-        return hashlib.sha224(item).hexdigest()
+    def wait(self, timeout=None, poll_interval=30):
+        """Block until there is work available or the queue is drained.
+
+        Returns False once the queue is empty, including work being done,
+        and True when there is work in the main queue or the optional
+        timeout elapsed. Unlike polling empty() and lease(), a waiting
+        client sends no commands: it is woken up by the notifications that
+        enqueue(), complete() and reap() publish on the queue's events
+        channel.
+
+        Items pushed to the main queue by other clients, such as redis-cli,
+        only wake waiters up if the server has keyspace notifications
+        enabled (CONFIG SET notify-keyspace-events Klz). Otherwise they are
+        noticed within poll_interval seconds.
+        """
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        pubsub = None
+        try:
+            while True:
+                main_size, processing_size = self._qsizes()
+                if main_size:
+                    return True
+                if not processing_size:
+                    return False
+                if pubsub is None:
+                    # Only subscribe when there is no work, then look at the
+                    # queue again so that no notification is lost.
+                    pubsub = self._db.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(
+                        self._events_channel, self._keyspace_channel)
+                    continue
+                wait_secs = poll_interval
+                if timeout is not None:
+                    wait_secs = min(wait_secs, deadline - time.monotonic())
+                    if wait_secs <= 0:
+                        return True
+                # Any message means the queue changed: look at it again.
+                pubsub.get_message(timeout=wait_secs)
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+
+    def enqueue(self, item, weight=0):
+        """Add 'item' to the work queue.
+
+        With weighted=True, items with a larger weight are leased first.
+        Otherwise the weight is ignored."""
+        self.enqueue_many([item], [weight])
+
+    def enqueue_many(self, items, weights=None):
+        """Add all the 'items' to the work queue in one round-trip.
+
+        With weighted=True, 'weights' gives the weight of each item,
+        which default to 0."""
+        if items:
+            with self._main_q_type_checked():
+                self._enqueue_pipeline(items, weights).execute()
 
     def _lease_exists(self, item):
         """True if a lease on 'item' exists."""
+        if self._layout == LAYOUT_ZSET:
+            deadline = self._db.zscore(self._leased_set_key, item)
+            if deadline is not None:
+                seconds, microseconds = self._db.time()
+                return deadline > seconds + microseconds / 1e6
+            if not self._compat:
+                return False
         return self._db.exists(self._lease_key_prefix + self._itemkey(item))
 
     def lease(self, lease_secs=60, block=True, timeout=None):
@@ -84,17 +452,21 @@ class RedisWQ(object):
 
         If optional args block is true and timeout is None (the default), block
         if necessary until an item is available."""
-        if block:
-            item = self._db.brpoplpush(
-                self._main_q_key,
-                self._processing_q_key,
-                timeout=timeout
-            )
-        else:
-            item = self._db.rpoplpush(
-                self._main_q_key,
-                self._processing_q_key
-            )
+        if self._layout == LAYOUT_ZSET or self._weighted:
+            items = self.lease_many(1, lease_secs, block, timeout)
+            return items[0] if items else None
+        with self._main_q_type_checked():
+            if block:
+                item = self._db.brpoplpush(
+                    self._main_q_key,
+                    self._processing_q_key,
+                    timeout=timeout
+                )
+            else:
+                item = self._db.rpoplpush(
+                    self._main_q_key,
+                    self._processing_q_key
+                )
         if item:
             # Record that we (this session id) are working on a key.
             # Expire that note after the lease timeout.
@@ -108,6 +480,92 @@ class RedisWQ(object):
             )
         return item
 
+    def lease_many(self, n, lease_secs=60, block=True, timeout=None):
+        """Begin working on up to n items of the work queue at once.
+
+        Returns a (possibly empty) list of items, each leased for
+        lease_secs. The items are claimed in one server-side script and
+        their leases are recorded in one pipeline, so leasing a window of
+        n items costs two round-trips instead of 2n.
+
+        If optional args block is true and no item is available right away,
+        block as lease() does until a single item is available."""
+        if self._layout == LAYOUT_ZSET:
+            with self._main_q_type_checked():
+                return self._zset_lease_many(n, lease_secs, block, timeout)
+        keys = [self._main_q_key, self._processing_q_key]
+        with self._main_q_type_checked():
+            items = self._lease_many_script(keys=keys, args=[n])
+        if not items and block and self._weighted:
+            items = self._wait_and_lease(
+                lambda: self._lease_many_script(keys=keys, args=[n]), timeout)
+        elif not items and block:
+            item = self.lease(lease_secs, block=True, timeout=timeout)
+            return [item] if item else []
+        if items:
+            # Note: as in lease(), if we crash before the pipeline executes,
+            # GC will see no lease for these items and return them to the
+            # main queue.
+            pipe = self._db.pipeline(transaction=False)
+            for item in items:
+                pipe.setex(
+                    self._lease_key_prefix + self._itemkey(item),
+                    lease_secs,
+                    self._session
+                )
+            pipe.execute()
+        return items
+
+    def _zset_lease_many(self, n, lease_secs, block, timeout):
+        """lease_many() for the "zset" layout."""
+        keys = [self._main_q_key, self._leased_set_key]
+        items = self._lease_many_script(keys=keys, args=[n, lease_secs])
+        if not items and block and self._weighted:
+            return self._wait_and_lease(
+                lambda: self._lease_many_script(
+                    keys=keys, args=[n, lease_secs]),
+                timeout)
+        if timeout:
+            deadline = time.monotonic() + timeout
+        while not items and block:
+            # Another worker may lease the item that woke this one up, so
+            # the timeout applies to the whole loop.
+            remaining = 0
+            if timeout:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            # The main queue cannot be moved into a sorted set by a blocking
+            # command, so wait for it to be non-empty instead: moving its
+            # last item back onto its own tail blocks like BRPOPLPUSH but
+            # consumes nothing and leaves the order unchanged. BLMOVE needs
+            # Redis 6.2 or later.
+            if self._db.blmove(self._main_q_key, self._main_q_key,
+                               remaining, "RIGHT", "RIGHT") is None:
+                break
+            items = self._lease_many_script(keys=keys, args=[n, lease_secs])
+        return items
+
+    def _wait_and_lease(self, lease_script, timeout):
+        """Block until lease_script() leases items, the timeout elapses or
+        the queue is drained.
+
+        Used with weighted=True, where no blocking command can pop the
+        main queue into processing atomically."""
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            remaining = None
+            if timeout is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+            if not self.wait(remaining):
+                return []
+            items = lease_script()
+            if items:
+                return items
+
     def complete(self, value):
         """Complete working on the item with 'value'.
 
@@ -115,10 +573,249 @@ class RedisWQ(object):
         other worker may have picked it up.  There is no indication
         of what happened.
         """
-        self._db.lrem(self._processing_q_key, 0, value)
-        # If we crash here, then the GC code will try to move the value,
-        # but it will not be here, which is fine.
-        # So this does not need to be a transaction.
-        itemkey = self._itemkey(value)
-        self._db.delete(self._lease_key_prefix + itemkey)
+        self.complete_many([value])
+
+    def complete_many(self, values):
+        """Complete working on all the items in 'values'.
+
+        Equivalent to calling complete() for each value, but acknowledges
+        all of them in a single round-trip.
+        """
+        if not values:
+            return
+        if self._renewer:
+            self._renewer.discard(values)
+        self._complete_script(
+            keys=self._complete_keys(values),
+            args=[self._events_channel] + list(values))
+
+    def renew(self, items, lease_secs=60):
+        """Extend the leases on 'items' to lease_secs from now.
+
+        Sends one command per item, all in a single pipelined round-trip.
+        Items whose lease already expired or that were completed are left
+        alone.
+        """
+        pipe = self._db.pipeline(transaction=False)
+        for item in items:
+            self._renew_in(pipe, item, lease_secs)
+        pipe.execute()
+
+    def _renew_in(self, pipe, item, lease_secs):
+        """Queue the renewal of the lease on 'item' in 'pipe'."""
+        if self._layout == LAYOUT_ZSET:
+            self._renew_script(
+                keys=[self._leased_set_key],
+                args=[lease_secs, item],
+                client=pipe
+            )
+        else:
+            pipe.expire(
+                self._lease_key_prefix + self._itemkey(item), lease_secs)
+
+    @contextlib.contextmanager
+    def keep_alive(self, items, lease_secs=60):
+        """Context manager that keeps the leases on 'items' alive.
+
+        While the block runs, a background thread renews the leases every
+        lease_secs / 3 seconds, so that items that take longer than
+        lease_secs to process are not picked up by other workers. Renewal
+        stops for an item when it is completed and for all the items when
+        the block exits, whether it succeeded or raised.
+        """
+        if self._renewer is None:
+            self._renewer = LeaseRenewer(self)
+            self._renewer.start()
+        self._renewer.add(items, lease_secs)
+        try:
+            yield items
+        finally:
+            self._renewer.discard(items)
+
+    def reap(self, batch_size=1000):
+        """Return items whose lease expired to the main queue.
+
+        Workers that crash or stall stop renewing their leases, and their
+        items would otherwise stay in processing forever, so that empty()
+        never becomes True. Returns the number of items requeued.
+
+        With the "zset" layout, expired leases are found with a range query
+        on the deadline-scored lease set and requeued by one script per
+        batch_size items.
+
+        The "list" layout has no deadline index: the whole processing list
+        is read batch_size items at a time, and the lease keys of each batch
+        are checked in one pipeline, so a pass costs O(N) for N items being
+        worked on. There is a window between lease() popping an item and
+        recording its lease, so an item is only requeued once two
+        consecutive reap() calls found it without a lease. Prefer the "zset"
+        layout for large queues, and run a single reaper per queue, e.g.
+        main() in a sidecar, rather than one per worker.
+        """
+        with self._main_q_type_checked():
+            return self._reap(batch_size)
+
+    def _reap(self, batch_size):
+        """reap() for either layout."""
+        reaped = 0
+        if self._layout == LAYOUT_ZSET:
+            keys = [self._main_q_key, self._leased_set_key, self._weights_key]
+            while True:
+                count = self._reap_script(
+                    keys=keys, args=[batch_size, self._events_channel])
+                reaped += count
+                if count < batch_size:
+                    break
+            if not self._compat:
+                return reaped
+        return reaped + self._reap_list(batch_size)
+
+    def _reap_list(self, batch_size):
+        """reap() for the processing list of the "list" layout."""
+        expired = []
+        start = 0
+        while True:
+            items = self._db.lrange(
+                self._processing_q_key, start, start + batch_size - 1)
+            pipe = self._db.pipeline(transaction=False)
+            for item in items:
+                pipe.exists(self._lease_key_prefix + self._itemkey(item))
+            expired += [item for item, exists in zip(items, pipe.execute())
+                        if not exists]
+            if len(items) < batch_size:
+                break
+            start += batch_size
+        candidates = [item for item in expired
+                      if item in self._reap_candidates]
+        self._reap_candidates = set(expired).difference(candidates)
+        reaped = 0
+        for i in range(0, len(candidates), batch_size):
+            batch = candidates[i:i + batch_size]
+            keys = [self._main_q_key, self._processing_q_key,
+                    self._weights_key]
+            keys += [self._lease_key_prefix + self._itemkey(item)
+                     for item in batch]
+            reaped += self._list_reap_script(
+                keys=keys, args=[self._events_channel] + batch)
+        return reaped
+
+    def start_reaper(self, interval=30):
+        """Run reap() every interval seconds in a daemon thread.
+
+        Returns the started LeaseReaper; call its stop() method to end it.
+        """
+        reaper = LeaseReaper(self, interval)
+        reaper.start()
+        return reaper
+
+
+class LeaseRenewer(threading.Thread):
+    """
+    Background thread that renews the leases registered with
+    RedisWQ.keep_alive(), all of them in one pipeline per pass.
+    """
+    def __init__(self, queue):
+        super().__init__(name="rediswq-renewer", daemon=True)
+        self._queue = queue
+        self._leases = {}  # item -> lease_secs
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+
+    def add(self, items, lease_secs):
+        """Start renewing the leases on 'items'."""
+        with self._lock:
+            for item in items:
+                self._leases[item] = lease_secs
+        self._changed.set()
+
+    def discard(self, items):
+        """Stop renewing the leases on 'items'."""
+        with self._lock:
+            for item in items:
+                self._leases.pop(item, None)
+
+    def run(self):
+        deadline = None
+        while True:
+            with self._lock:
+                interval = min(self._leases.values(), default=None)
+            if interval is None:
+                # Nothing to renew: sleep until add() is called.
+                self._changed.wait()
+                self._changed.clear()
+                deadline = None
+                continue
+            now = time.monotonic()
+            if deadline is None or now + interval / 3 < deadline:
+                deadline = now + interval / 3
+            if self._changed.wait(deadline - now):
+                # Leases were added, possibly shorter ones.
+                self._changed.clear()
+                continue
+            deadline = None
+            with self._lock:
+                leases = list(self._leases.items())
+            pipe = self._queue._db.pipeline(transaction=False)
+            for item, lease_secs in leases:
+                self._queue._renew_in(pipe, item, lease_secs)
+            try:
+                pipe.execute()
+            except redis.RedisError as e:
+                print("Lease renewal failed: " + str(e))
+
+
+class LeaseReaper(threading.Thread):
+    """
+    Background thread that periodically returns expired leases of a
+    RedisWQ to its main queue.
+    """
+    def __init__(self, queue, interval=30):
+        super().__init__(name="rediswq-reaper", daemon=True)
+        self._queue = queue
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                reaped = self._queue.reap()
+            except redis.RedisError as e:
+                print("Lease reaper failed: " + str(e))
+                continue
+            if reaped:
+                print("Lease reaper requeued {} item(s)".format(reaped))
+
+    def stop(self):
+        """Stop the reaper after its current pass."""
+        self._stopped.set()
+
+
+def main():
+    """
+    Standalone lease reaper, e.g. for a sidecar or a CronJob. Run one per
+    queue instead of one in each worker:
+
+      python rediswq.py --host redis --name datasets --interval 30
+    """
+    parser = argparse.ArgumentParser(
+        description="Return expired RedisWQ leases to the main queue.")
+    parser.add_argument("--name", default="datasets")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument(
+        "--layout", choices=[LAYOUT_LIST, LAYOUT_ZSET], default=LAYOUT_LIST)
+    parser.add_argument(
+        "--interval", type=float, default=30, help="seconds between passes")
+    parser.add_argument(
+        "--weighted", action="store_true",
+        help="the main queue is a sorted set scored by weight")
+    args = parser.parse_args()
+
+    q = RedisWQ(
+        name=args.name, layout=args.layout, weighted=args.weighted,
+        host=args.host, port=args.port)
+    q.start_reaper(interval=args.interval).join()
+
 
+if __name__ == "__main__":
+    main()
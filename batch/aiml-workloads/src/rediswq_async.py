@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import contextlib
+import time
+import redis
+import redis.asyncio
+from rediswq import _RedisWQBase, LAYOUT_LIST, LAYOUT_ZSET
+
+
+class AsyncRedisWQ(_RedisWQBase):
+    """
+    asyncio counterpart of RedisWQ
+
+    Same queue layouts and semantics as RedisWQ, but every call is a
+    coroutine. Unlike RedisWQ, one AsyncRedisWQ is meant to be shared by
+    many coroutines of a process, each holding its own leases: commands
+    are sent over a shared pool of at most max_connections connections.
+    Coroutines blocked in lease() or wait() hold none of them: a single
+    task listens for the queue's notifications on one more connection,
+    outside the pool, and wakes them all up.
+    """
+    def __init__(self, name, layout=LAYOUT_LIST, compat=True, weighted=False,
+                 max_connections=10, connection_pool=None, **redis_kwargs):
+        """
+        The default connection parameters are:
+        host='localhost', port=6379, db=0
+
+        The work queue is identified by "name". Pass connection_pool to
+        share a redis.asyncio connection pool between several queues.
+        """
+        if connection_pool is None:
+            # Wait for a free connection rather than fail when more
+            # coroutines than max_connections use the queue at once.
+            connection_pool = redis.asyncio.BlockingConnectionPool(
+                max_connections=max_connections, **redis_kwargs)
+        self._setup(redis.asyncio.StrictRedis(connection_pool=connection_pool),
+                    name, layout, compat, weighted)
+        # The notifications wait() listens for are received by one task,
+        # started by the first wait() that finds no work, on a connection
+        # of its own so that waiters never starve the pool. It sets and
+        # replaces _notified on each message.
+        self._pubsub_db = redis.asyncio.StrictRedis(
+            connection_pool=redis.asyncio.ConnectionPool(
+                connection_class=connection_pool.connection_class,
+                max_connections=1,
+                **connection_pool.connection_kwargs))
+        self._listener = None
+        self._subscribed = None
+        self._notified = asyncio.Event()
+        # Leases registered with keep_alive(), renewed by one task.
+        self._leases = {}  # item -> lease_secs
+        self._leases_changed = asyncio.Event()
+        self._renewer = None
+
+    async def aclose(self):
+        """Stop renewing leases and listening for notifications, and close
+        the connection pool."""
+        if self._renewer:
+            self._renewer.cancel()
+        if self._listener:
+            self._listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._listener
+        await self._pubsub_db.aclose()
+        await self._db.aclose()
+
+    async def _qsizes(self):
+        """Return the sizes of the main and processing queues, in one
+        round-trip."""
+        with self._main_q_type_checked():
+            main_size, *processing_sizes = (
+                await self._qsizes_pipeline().execute())
+        return main_size, sum(processing_sizes)
+
+    async def empty(self):
+        """Return True if the queue is empty, including work being done,
+        False otherwise."""
+        return await self._qsizes() == (0, 0)
+
+    async def wait(self, timeout=None, poll_interval=30):
+        """Block until there is work available or the queue is drained.
+
+        See RedisWQ.wait()."""
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        listening = False
+        while True:
+            # Taken before looking at the queue, so that no notification
+            # sent after that is missed.
+            notified = self._notified
+            main_size, processing_size = await self._qsizes()
+            if main_size:
+                return True
+            if not processing_size:
+                return False
+            if not listening:
+                # As in RedisWQ.wait(), only listen when there is no work,
+                # then look at the queue again.
+                await self._listen()
+                listening = True
+                continue
+            wait_secs = poll_interval
+            if timeout is not None:
+                wait_secs = min(wait_secs, deadline - time.monotonic())
+                if wait_secs <= 0:
+                    return True
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(notified.wait(), wait_secs)
+
+    async def _listen(self):
+        """Start the task listening for notifications, if it's not running,
+        and return once it is subscribed."""
+        if self._listener is None or self._listener.done():
+            self._subscribed = asyncio.get_running_loop().create_future()
+            self._listener = asyncio.create_task(
+                self._listen_for_notifications(self._subscribed))
+        # Shielded, so that a waiter cancelled while the listener
+        # subscribes doesn't cancel it for the others.
+        await asyncio.shield(self._subscribed)
+
+    async def _listen_for_notifications(self, subscribed):
+        """Wake up the waiters on each message of the events and keyspace
+        channels. If the connection fails, the waiters are woken up to
+        look at the queue, and the next one starts a new listener."""
+        pubsub = self._pubsub_db.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(
+                self._events_channel, self._keyspace_channel)
+            subscribed.set_result(None)
+            async for _ in pubsub.listen():
+                self._wake_waiters()
+        except redis.RedisError as e:
+            if not subscribed.done():
+                subscribed.set_exception(e)
+            else:
+                print("Queue notifications failed: " + str(e))
+                self._wake_waiters()
+        finally:
+            if not subscribed.done():
+                subscribed.cancel()
+            await pubsub.aclose()
+
+    def _wake_waiters(self):
+        """Wake up the coroutines blocked in wait()."""
+        notified, self._notified = self._notified, asyncio.Event()
+        notified.set()
+
+    async def enqueue(self, item, weight=0):
+        """Add 'item' to the work queue. See RedisWQ.enqueue()."""
+        await self.enqueue_many([item], [weight])
+
+    async def enqueue_many(self, items, weights=None):
+        """Add all the 'items' to the work queue in one round-trip."""
+        if items:
+            with self._main_q_type_checked():
+                await self._enqueue_pipeline(items, weights).execute()
+
+    async def lease(self, lease_secs=60, block=True, timeout=None):
+        """Begin working on an item the work queue. See RedisWQ.lease()."""
+        items = await self.lease_many(1, lease_secs, block, timeout)
+        return items[0] if items else None
+
+    async def lease_many(self, n, lease_secs=60, block=True, timeout=None):
+        """Begin working on up to n items of the work queue at once.
+
+        See RedisWQ.lease_many(). If block is true, wait() for work
+        until timeout, or until the queue is drained."""
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            with self._main_q_type_checked():
+                items = await self._lease_many(n, lease_secs)
+            if items or not block:
+                return items
+            remaining = None
+            if timeout is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+            if not await self.wait(remaining):
+                return []
+
+    async def _lease_many(self, n, lease_secs):
+        """Lease up to n items without blocking."""
+        if self._layout == LAYOUT_ZSET:
+            return await self._lease_many_script(
+                keys=[self._main_q_key, self._leased_set_key],
+                args=[n, lease_secs])
+        items = await self._lease_many_script(
+            keys=[self._main_q_key, self._processing_q_key], args=[n])
+        if items:
+            pipe = self._db.pipeline(transaction=False)
+            for item in items:
+                pipe.setex(
+                    self._lease_key_prefix + self._itemkey(item),
+                    lease_secs,
+                    self._session
+                )
+            await pipe.execute()
+        return items
+
+    async def complete(self, value):
+        """Complete working on the item with 'value'."""
+        await self.complete_many([value])
+
+    async def complete_many(self, values):
+        """Complete working on all the items in 'values' in one
+        round-trip."""
+        if not values:
+            return
+        for value in values:
+            self._leases.pop(value, None)
+        await self._complete_script(
+            keys=self._complete_keys(values),
+            args=[self._events_channel] + list(values))
+
+    async def renew(self, items, lease_secs=60):
+        """Extend the leases on 'items' to lease_secs from now, in one
+        pipelined round-trip."""
+        await self._renew([(item, lease_secs) for item in items])
+
+    async def _renew(self, leases):
+        """Renew the (item, lease_secs) 'leases' in one pipeline."""
+        pipe = self._db.pipeline(transaction=False)
+        for item, lease_secs in leases:
+            if self._layout == LAYOUT_ZSET:
+                await self._renew_script(
+                    keys=[self._leased_set_key],
+                    args=[lease_secs, item],
+                    client=pipe
+                )
+            else:
+                pipe.expire(
+                    self._lease_key_prefix + self._itemkey(item), lease_secs)
+        await pipe.execute()
+
+    @contextlib.asynccontextmanager
+    async def keep_alive(self, items, lease_secs=60):
+        """Async context manager that keeps the leases on 'items' alive.
+
+        See RedisWQ.keep_alive(). The leases of all the coroutines are
+        renewed together by a single task."""
+        if self._renewer is None:
+            self._renewer = asyncio.create_task(self._renew_leases())
+        for item in items:
+            self._leases[item] = lease_secs
+        self._leases_changed.set()
+        try:
+            yield items
+        finally:
+            for item in items:
+                self._leases.pop(item, None)
+
+    async def _renew_leases(self):
+        """Renew the leases registered with keep_alive() every third of
+        the shortest lease."""
+        deadline = None
+        while True:
+            interval = min(self._leases.values(), default=None)
+            if interval is None:
+                await self._leases_changed.wait()
+                self._leases_changed.clear()
+                deadline = None
+                continue
+            now = time.monotonic()
+            if deadline is None or now + interval / 3 < deadline:
+                deadline = now + interval / 3
+            try:
+                await asyncio.wait_for(
+                    self._leases_changed.wait(), deadline - now)
+                self._leases_changed.clear()
+                continue
+            except asyncio.TimeoutError:
+                pass
+            deadline = None
+            try:
+                await self._renew(list(self._leases.items()))
+            except redis.RedisError as e:
+                print("Lease renewal failed: " + str(e))
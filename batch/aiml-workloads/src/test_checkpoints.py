@@ -0,0 +1,119 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDClassifier
+
+import checkpoints
+
+
+def make_model(seed=0):
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame({
+        "TX_AMOUNT": rng.random(40),
+        "TX_DURING_NIGHT": rng.integers(0, 2, 40),
+    })
+    labels = np.arange(40) % 4
+    model = SGDClassifier(warm_start=True, random_state=seed)
+    model.partial_fit(features, labels, classes=[0, 1, 2, 3])
+    return model, features, labels
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.model, self.features, self.labels = make_model()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def assertSameModel(self, model, expected):
+        np.testing.assert_array_equal(model.coef_, expected.coef_)
+        np.testing.assert_array_equal(model.intercept_, expected.intercept_)
+        np.testing.assert_array_equal(model.classes_, expected.classes_)
+        np.testing.assert_array_equal(
+            model.predict(self.features), expected.predict(self.features))
+
+    def test_npz_round_trip(self):
+        path = self.path("model_cpt_a.npz")
+        checkpoints.save_checkpoint(self.model, path)
+        model = checkpoints.load_checkpoint(path)
+        self.assertSameModel(model, self.model)
+        self.assertEqual(model.t_, self.model.t_)
+        self.assertEqual(list(model.feature_names_in_),
+                         ["TX_AMOUNT", "TX_DURING_NIGHT"])
+        # The restored model resumes training
+        model.partial_fit(self.features, self.labels)
+        self.assertGreater(model.t_, self.model.t_)
+
+    def test_legacy_pickle(self):
+        path = self.path("model_cpt_a.pkl")
+        with open(path, 'wb') as f:
+            pickle.dump(self.model, f)
+        self.assertSameModel(checkpoints.load_checkpoint(path), self.model)
+
+    def test_latest_pointer(self):
+        self.assertIsNone(checkpoints.latest_checkpoint(self.dir.name))
+        for name in ("model_cpt_a.npz", "model_cpt_b.npz"):
+            path = self.path(name)
+            checkpoints.save_checkpoint(self.model, path)
+            checkpoints.publish_latest(self.dir.name, path)
+            self.assertEqual(checkpoints.latest_checkpoint(self.dir.name), path)
+        self.assertEqual(sorted(os.listdir(self.dir.name)), [
+            checkpoints.LATEST_FILENAME, "model_cpt_a.npz", "model_cpt_b.npz"])
+
+    def test_empty_latest_pointer(self):
+        open(self.path(checkpoints.LATEST_FILENAME), 'wb').close()
+        self.assertIsNone(checkpoints.latest_checkpoint(self.dir.name))
+
+    def test_failed_save_keeps_previous_checkpoint(self):
+        path = self.path("model_cpt_a.npz")
+        checkpoints.save_checkpoint(self.model, path)
+        checkpoints.publish_latest(self.dir.name, path)
+        other, _, _ = make_model(seed=1)
+
+        def partial_savez(f, **state):
+            f.write(b"PK\x03\x04")
+            raise OSError("No space left on device")
+
+        with mock.patch.object(np, "savez", partial_savez):
+            with self.assertRaises(OSError):
+                checkpoints.save_checkpoint(other, path)
+        # Neither the partial file nor the temporary file is left behind
+        self.assertEqual(sorted(os.listdir(self.dir.name)), [
+            checkpoints.LATEST_FILENAME, "model_cpt_a.npz"])
+        latest = checkpoints.latest_checkpoint(self.dir.name)
+        self.assertSameModel(checkpoints.load_checkpoint(latest), self.model)
+
+    def test_missing_checkpoint(self):
+        checkpoints.publish_latest(
+            self.dir.name, self.path("model_cpt_a.npz"))
+        with self.assertRaises(FileNotFoundError):
+            checkpoints.load_checkpoint(
+                checkpoints.latest_checkpoint(self.dir.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import fakeredis
+import numpy as np
+import redis
+
+import checkpoints
+import model_averaging
+import rediswq
+from test_checkpoints import make_model
+
+
+class TestModelAverager(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = self.dir.name + "/"
+        pool = redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection,
+            server=fakeredis.FakeServer())
+        self.queue = rediswq.RedisWQ(name="q", connection_pool=pool)
+        self.base, self.features, self.labels = make_model()
+        self.base_path = self.checkpoint_dir + "model_cpt_base.npz"
+        checkpoints.save_checkpoint(self.base, self.base_path)
+        checkpoints.publish_latest(self.checkpoint_dir, self.base_path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def averager(self, mix_every=2):
+        return model_averaging.ModelAverager(
+            self.queue, self.checkpoint_dir, mix_every=mix_every)
+
+    def trained(self, rows):
+        """Returns a model trained from the base checkpoint on rows rows."""
+        model = checkpoints.load_checkpoint(self.base_path)
+        model.set_params(random_state=0)
+        model.partial_fit(self.features[:rows], self.labels[:rows])
+        return model
+
+    def test_updates_are_averaged_by_weight(self):
+        averager = self.averager()
+        first, second = self.trained(10), self.trained(30)
+        self.assertIsNone(averager.publish(self.base_path, first, 10))
+        path = averager.publish(self.base_path, second, 30)
+
+        self.assertEqual(path, self.checkpoint_dir + "model_avg_000001.npz")
+        self.assertEqual(checkpoints.latest_checkpoint(self.checkpoint_dir),
+                         path)
+        model = checkpoints.load_checkpoint(path)
+        np.testing.assert_allclose(
+            model.coef_, 0.25 * first.coef_ + 0.75 * second.coef_)
+        np.testing.assert_allclose(
+            model.intercept_,
+            0.25 * first.intercept_ + 0.75 * second.intercept_)
+        self.assertIsNone(averager.reduce())
+
+    def test_next_average_starts_from_shared_model(self):
+        averager = self.averager(mix_every=1)
+        first = averager.publish(self.base_path, self.trained(10), 10)
+        # A worker still training from the base checkpoint: its update is
+        # applied to the shared model, not to the checkpoint it read.
+        os.remove(first)
+        model = self.trained(20)
+        second = averager.publish(self.base_path, model, 20)
+        self.assertEqual(second, self.checkpoint_dir + "model_avg_000002.npz")
+        expected = (self.trained(10).coef_ - self.base.coef_ +
+                    model.coef_)
+        np.testing.assert_allclose(
+            checkpoints.load_checkpoint(second).coef_, expected)
+
+    def test_checkpoint_io_is_outside_lock(self):
+        averager = self.averager(mix_every=1)
+        model = self.trained(10)
+        lock_key = self.queue.key("model_lock")
+        locked = []
+
+        def recording(function):
+            def call(*args):
+                locked.append(self.queue.db.exists(lock_key))
+                return function(*args)
+            return call
+
+        with mock.patch.multiple(
+                checkpoints,
+                load_checkpoint=recording(checkpoints.load_checkpoint),
+                save_checkpoint=recording(checkpoints.save_checkpoint)):
+            averager.publish(self.base_path, model, 10)
+        # The base checkpoint is loaded by publish() and reduce(), and the
+        # average is saved, all without holding the lock
+        self.assertEqual(locked, [0, 0, 0])
+
+    def test_older_version_is_not_published(self):
+        averager = self.averager(mix_every=1)
+        save_checkpoint = checkpoints.save_checkpoint
+
+        def slow_save(model, path):
+            # Another worker averages and publishes while this one saves
+            self.queue.db.incr(self.queue.key("model_version"))
+            save_checkpoint(model, path)
+
+        with mock.patch.object(checkpoints, "save_checkpoint", slow_save):
+            path = averager.publish(self.base_path, self.trained(10), 10)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(checkpoints.latest_checkpoint(self.checkpoint_dir),
+                         self.base_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import convert_datasets
+import model_training
+
+LABEL = "TX_FRAUD_SCENARIO"
+
+
+def make_dataset(rows=100):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "TX_AMOUNT": rng.random(rows),
+        "TX_DURING_NIGHT": rng.integers(0, 2, rows),
+        LABEL: np.arange(rows) % 4,
+    })
+
+
+class TestModelTraining(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dataset = make_dataset()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_feather_round_trip(self):
+        path = self.path("dataset.feather")
+        self.dataset.to_feather(path)
+        pd.testing.assert_frame_equal(
+            model_training._load_dataset(path), self.dataset)
+        chunks = list(model_training._iter_dataset_chunks(path, 30))
+        self.assertEqual([len(c) for c in chunks], [30, 30, 30, 10])
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True), self.dataset)
+
+    def test_converted_pickle_streams_in_row_groups(self):
+        pickle_path = self.path("dataset.pkl")
+        self.dataset.to_pickle(pickle_path)
+        path = convert_datasets.convert(pickle_path, row_group_size=40)
+        self.assertEqual(path, self.path("dataset.parquet"))
+        chunks = list(model_training._iter_dataset_chunks(path, 40))
+        self.assertEqual([len(c) for c in chunks], [40, 40, 20])
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True), self.dataset)
+
+    def test_feather_streams_record_batches(self):
+        pickle_path = self.path("dataset.pkl")
+        self.dataset.to_pickle(pickle_path)
+        path = convert_datasets.convert(
+            pickle_path, row_group_size=40, format="feather")
+        self.assertEqual(path, self.path("dataset.feather"))
+        # The batches of 40 rows are read one at a time, then sliced
+        with mock.patch("pyarrow.ipc.RecordBatchFileReader.read_all") as read_all:
+            chunks = list(model_training._iter_dataset_chunks(path, 30))
+        read_all.assert_not_called()
+        self.assertEqual([len(c) for c in chunks], [30, 10, 30, 10, 20])
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True), self.dataset)
+
+    def test_train_on_feather(self):
+        train_path = self.path("train.feather")
+        test_path = self.path("test.feather")
+        self.dataset.to_feather(train_path)
+        self.dataset.to_feather(test_path)
+        trainer = model_training.FraudDetectionModelTrainer(
+            train_path, test_path, LABEL, chunk_size=30)
+        trainer.train_and_save(self.dir.name)
+        self.assertEqual(trainer.get_train_samples(), len(self.dataset))
+
+    def test_chunks_are_scored_before_training(self):
+        train_path = self.path("train.feather")
+        self.dataset.to_feather(train_path)
+        trainer = model_training.FraudDetectionModelTrainer(
+            train_path, train_path, LABEL, chunk_size=30)
+        model = trainer.get_model()
+        calls = []
+        partial_fit, predict = model.partial_fit, model.predict
+
+        def record(name, method):
+            def call(features, *args, **kwargs):
+                calls.append((name, len(features)))
+                return method(features, *args, **kwargs)
+            return call
+
+        with mock.patch.multiple(model, partial_fit=record("fit", partial_fit),
+                                 predict=record("predict", predict)):
+            trainer.train_and_save(self.dir.name)
+        # Test, then train: the first chunk of a new model is not scored
+        self.assertEqual(calls, [
+            ("fit", 30), ("predict", 30), ("fit", 30), ("predict", 30),
+            ("fit", 30), ("predict", 10), ("fit", 10)])
+        self.assertIn("evaluate", trainer.get_timings())
+
+        report_path = self.path("report.txt")
+        trainer.generate_report(report_path)
+        with open(report_path) as f:
+            self.assertIn("Progressive validation accuracy on training data",
+                          f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+import fakeredis.aioredis
+import redis
+import redis.asyncio
+
+import rediswq
+import rediswq_async
+
+
+class TestRedisWQ(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+
+    def queue(self, **kwargs):
+        pool = redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection, server=self.server)
+        return rediswq.RedisWQ(name="q", connection_pool=pool, **kwargs)
+
+    def test_lease_many_and_complete_many(self):
+        for layout in (rediswq.LAYOUT_LIST, rediswq.LAYOUT_ZSET):
+            with self.subTest(layout=layout):
+                q = self.queue(layout=layout)
+                q.enqueue_many([b"a", b"b", b"c"])
+                items = q.lease_many(2, lease_secs=60, block=False)
+                self.assertEqual(len(items), 2)
+                self.assertTrue(all(q._lease_exists(item) for item in items))
+                self.assertEqual(q._qsizes(), (1, 2))
+                rest = q.lease_many(5, lease_secs=60, block=False)
+                self.assertEqual(sorted(items + rest), [b"a", b"b", b"c"])
+                self.assertEqual(q.lease_many(5, block=False), [])
+                q.complete_many(items + rest)
+                self.assertFalse(any(q._lease_exists(item)
+                                     for item in items + rest))
+                self.assertTrue(q.empty())
+
+    def test_expired_leases_are_reaped(self):
+        q = self.queue()
+        q.enqueue_many([b"a", b"b"])
+        expired, leased = q.lease_many(2, lease_secs=60, block=False)
+        q.db.pexpire(q._lease_key_prefix + q._itemkey(expired), 1)
+        time.sleep(0.01)
+        self.assertFalse(q._lease_exists(expired))
+        self.assertEqual(q.reap(), 0)
+        self.assertEqual(q.reap(), 1)
+        self.assertEqual(q.lease(block=False), expired)
+        q.complete_many([expired, leased])
+        self.assertTrue(q.empty())
+
+    def test_zset_expired_leases_are_reaped(self):
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        q.enqueue_many([b"a", b"b"])
+        expired = q.lease(lease_secs=0, block=False)
+        leased = q.lease(lease_secs=60, block=False)
+        self.assertFalse(q._lease_exists(expired))
+        # The lease set is indexed by deadline: no second pass is needed
+        self.assertEqual(q.reap(), 1)
+        self.assertEqual(q.db.zrange("q:leased", 0, -1), [leased])
+        self.assertEqual(q.lease(block=False), expired)
+
+    def test_compat_zset_reads_list_layout_leases(self):
+        old = self.queue()
+        old.enqueue_many([b"a", b"b", b"c"])
+        done, running, expired = old.lease_many(3, lease_secs=60, block=False)
+        old.db.delete(old._lease_key_prefix + old._itemkey(expired))
+
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        self.assertTrue(q._lease_exists(running))
+        self.assertFalse(q._lease_exists(expired))
+        self.assertEqual(q._qsizes(), (0, 3))
+        q.complete(done)
+        self.assertFalse(old._lease_exists(done))
+        self.assertEqual(q.reap(), 0)
+        self.assertEqual(q.reap(), 1)
+        # The requeued item is leased into the lease set
+        self.assertEqual(q.lease(lease_secs=60, block=False), expired)
+        self.assertIsNotNone(q.db.zscore("q:leased", expired))
+        q.complete_many([running, expired])
+        self.assertTrue(q.empty())
+        self.assertEqual(q.db.keys("q:*"), [])
+
+    def test_zset_without_compat_ignores_list_layout(self):
+        old = self.queue()
+        old.enqueue(b"a")
+        old.lease(lease_secs=60, block=False)
+        q = self.queue(layout=rediswq.LAYOUT_ZSET, compat=False)
+        self.assertTrue(q.empty())
+        self.assertFalse(q._lease_exists(b"a"))
+
+    def test_zset_lease_records_deadline(self):
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        q.enqueue(b"a")
+        self.assertEqual(q.lease(lease_secs=60, block=False), b"a")
+        db = q._db
+        self.assertIsNotNone(db.zscore("q:leased", b"a"))
+        self.assertEqual(db.llen("q:processing"), 0)
+        self.assertEqual(db.keys("q:leased_by_session:*"), [])
+        self.assertTrue(q._lease_exists(b"a"))
+        q.complete(b"a")
+        self.assertTrue(q.empty())
+
+    def test_zset_blocking_lease_records_deadline(self):
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        q.enqueue(b"a")
+        self.assertEqual(q.lease(lease_secs=60, timeout=1), b"a")
+        self.assertIsNotNone(q._db.zscore("q:leased", b"a"))
+        self.assertEqual(q._db.llen("q:processing"), 0)
+
+    def test_zset_lease_timeout_bounds_whole_wait(self):
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        timeouts = []
+
+        def blmove(*args):
+            # Wakes up for an item that another worker leases first
+            timeouts.append(args[2])
+            time.sleep(0.05)
+            return b"a"
+
+        with mock.patch.object(q._db, "blmove", side_effect=blmove):
+            start = time.monotonic()
+            self.assertEqual(q.lease_many(2, timeout=0.2), [])
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertLessEqual(len(timeouts), 5)
+        self.assertEqual(timeouts, sorted(timeouts, reverse=True))
+        self.assertLessEqual(timeouts[0], 0.2)
+
+    def test_list_reap_scans_whole_processing_list(self):
+        q = self.queue()
+        q.enqueue_many([str(i).encode() for i in range(25)])
+        items = q.lease_many(25, lease_secs=60, block=False)
+        # Expire the leases of the items leased first, which are at the
+        # head of the processing list, furthest from its oldest entries.
+        expired = items[-7:]
+        q._db.delete(*[q._lease_key_prefix + q._itemkey(item)
+                       for item in expired])
+        # Requeued once two passes found them without a lease
+        self.assertEqual(q.reap(batch_size=5), 0)
+        self.assertEqual(q.reap(batch_size=5), 7)
+        self.assertEqual(sorted(q._db.lrange("q", 0, -1)), sorted(expired))
+        self.assertEqual(q._db.llen("q:processing"), 18)
+
+    def test_keep_alive_renews_past_deadline(self):
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        q.enqueue_many([b"a", b"b"])
+        renewed = q.lease(lease_secs=0.3, block=False)
+        other = q.lease(lease_secs=0.3, block=False)
+        with q.keep_alive([renewed], lease_secs=0.3):
+            time.sleep(0.5)
+            self.assertTrue(q._lease_exists(renewed))
+            self.assertFalse(q._lease_exists(other))
+            self.assertEqual(q.reap(), 1)
+            q.complete(renewed)
+            # Completed items are no longer renewed
+            self.assertEqual(q._renewer._leases, {})
+        self.assertIsNone(q.db.zscore("q:leased", renewed))
+
+    def test_keep_alive_stops_after_block(self):
+        q = self.queue(layout=rediswq.LAYOUT_ZSET)
+        q.enqueue(b"a")
+        item = q.lease(lease_secs=0.3, block=False)
+        with q.keep_alive([item], lease_secs=0.3):
+            time.sleep(0.2)
+        self.assertEqual(q._renewer._leases, {})
+        time.sleep(0.4)
+        self.assertFalse(q._lease_exists(item))
+
+    def test_weighted_queue_filled_as_list(self):
+        self.queue().enqueue(b"a")
+        q = self.queue(layout=rediswq.LAYOUT_ZSET, weighted=True)
+        with self.assertRaisesRegex(rediswq.QueueTypeError, "sorted set"):
+            q.lease(block=False)
+        with self.assertRaises(rediswq.QueueTypeError):
+            q.empty()
+
+    def test_list_queue_filled_as_sorted_set(self):
+        self.queue(weighted=True).enqueue(b"a", 10)
+        q = self.queue()
+        with self.assertRaisesRegex(rediswq.QueueTypeError, "a list"):
+            q.lease(block=False)
+        with self.assertRaises(rediswq.QueueTypeError):
+            q.enqueue(b"b")
+
+    def test_shared_state_keys(self):
+        q = self.queue()
+        self.assertEqual(q.key("model_updates"), "q:model_updates")
+        q.db.rpush(q.key("model_updates"), b"update")
+        self.assertTrue(q.empty())
+
+    def test_wait_with_work_does_not_subscribe(self):
+        q = self.queue()
+        q.enqueue(b"a")
+        with mock.patch.object(q._db, "pubsub") as pubsub:
+            self.assertTrue(q.wait())
+        pubsub.assert_not_called()
+
+    def test_wait_subscribes_when_idle(self):
+        q = self.queue()
+        q.enqueue(b"a")
+        q.lease(block=False)
+        with mock.patch.object(q._db, "pubsub", wraps=q._db.pubsub) as pubsub:
+            self.assertTrue(q.wait(timeout=0.1, poll_interval=0.05))
+        pubsub.assert_called_once()
+        q.complete(b"a")
+        self.assertFalse(q.wait())
+
+    def test_async_wait_with_work_does_not_subscribe(self):
+        async def wait():
+            pool = redis.asyncio.ConnectionPool(
+                connection_class=fakeredis.aioredis.FakeConnection,
+                server=self.server)
+            q = rediswq_async.AsyncRedisWQ(name="q", connection_pool=pool)
+            await q.enqueue(b"a")
+            with mock.patch.object(q._pubsub_db, "pubsub") as pubsub:
+                self.assertTrue(await q.wait())
+            pubsub.assert_not_called()
+            await q.aclose()
+
+        asyncio.run(wait())
+
+    def test_async_waiters_share_one_connection(self):
+        async def wait():
+            pool = redis.asyncio.BlockingConnectionPool(
+                connection_class=fakeredis.aioredis.FakeConnection,
+                server=self.server, max_connections=2, timeout=1)
+            q = rediswq_async.AsyncRedisWQ(name="q", connection_pool=pool)
+            await q.enqueue(b"a")
+            item = await q.lease(block=False)
+            # More waiters than connections in the pool
+            waiters = [asyncio.create_task(q.lease(timeout=5))
+                       for _ in range(5)]
+            await asyncio.sleep(0.1)
+            self.assertFalse(any(waiter.done() for waiter in waiters))
+            await asyncio.wait_for(q.renew([item]), 0.5)
+            await asyncio.wait_for(
+                q.enqueue_many([str(i).encode() for i in range(5)]), 0.5)
+            leased = await asyncio.wait_for(asyncio.gather(*waiters), 2)
+            self.assertEqual(sorted(leased), [b"0", b"1", b"2", b"3", b"4"])
+            await asyncio.wait_for(q.complete_many([item] + leased), 0.5)
+            self.assertFalse(await asyncio.wait_for(q.wait(), 0.5))
+            await q.aclose()
+
+        asyncio.run(wait())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+
+from worker_metrics import WorkerMetrics
+
+
+class TestWorkerMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # The metrics directory is created if needed
+        self.path = os.path.join(self.dir.name, "metrics", "worker-a.jsonl")
+        self.metrics = WorkerMetrics(self.path, "a")
+
+    def tearDown(self):
+        if not self.metrics._file.closed:
+            self.metrics._file.close()
+        self.dir.cleanup()
+
+    def read_lines(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_lines_are_flushed_as_written(self):
+        self.metrics.record_lease([b"a", b"b"], 1.5, 0.25)
+        # Readable before close(), e.g. if the worker is killed
+        lease, = self.read_lines()
+        self.assertEqual(lease["event"], "lease")
+        self.assertEqual(lease["session"], "a")
+        self.assertEqual(lease["items"], 2)
+        self.assertEqual(lease["queue_wait_secs"], 1.5)
+        self.assertEqual(lease["lease_secs"], 0.25)
+        self.assertIsInstance(lease["time"], float)
+
+    def test_items_and_summary(self):
+        stages = {}
+        with self.metrics.timed(stages, "complete"):
+            pass
+        self.assertIn("complete", stages)
+        self.metrics.record_lease([b"a"], 2.0, 0.5)
+        self.metrics.record_item("a.parquet", {"train": 3.0, "save": 1.0}, 100)
+        self.metrics.record_item("b.parquet", {"train": 1.0}, 50)
+        self.metrics.close()
+
+        self.assertTrue(self.metrics._file.closed)
+        lease, first, second, summary = self.read_lines()
+        self.assertEqual(first["event"], "item")
+        self.assertEqual(first["item"], "a.parquet")
+        self.assertEqual(first["bytes_read"], 100)
+        self.assertEqual(first["total_secs"], 4.0)
+        self.assertEqual(first["stages"], {"train": 3.0, "save": 1.0})
+        self.assertEqual(summary["event"], "summary")
+        self.assertEqual(summary["items"], 2)
+        self.assertEqual(summary["bytes_read"], 150)
+        self.assertEqual(summary["stages"], {
+            "queue_wait": 2.0, "lease": 0.5, "train": 4.0, "save": 1.0})
+        self.assertGreater(summary["items_per_sec"], 0)
+
+    def test_appends_to_existing_file(self):
+        self.metrics.close()
+        metrics = WorkerMetrics(self.path, "a")
+        metrics.close()
+        self.assertEqual([line["event"] for line in self.read_lines()],
+                         ["summary", "summary"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,58 +14,145 @@
 # limitations under the License.
 
 import os
+import time
 import rediswq
+import checkpoints
+from model_averaging import ModelAverager
 from model_training import FraudDetectionModelTrainer
+from worker_metrics import WorkerMetrics
 
 # Initialize variables
 FILESTORE_PATH = "/mnt/fileserver/"
-TESTING_DATASET_PATH = FILESTORE_PATH + "datasets/testing/test_dataset.pkl"
+# Converted from Pickle by transfer-datasets.sh, so that they can be
+# streamed in chunks
+TESTING_DATASET_PATH = FILESTORE_PATH + "datasets/testing/test_dataset.parquet"
 OUTPUT_DIR = FILESTORE_PATH + "output/"
 REPORT_PATH = OUTPUT_DIR + "report.txt"
+# Each worker writes its metrics, as JSON lines, to a file of this directory
+METRICS_DIR = OUTPUT_DIR + "metrics/"
 CLASS_LABEL = "TX_FRAUD_SCENARIO"
 QUEUE_NAME = "datasets"
 HOST = "redis"
+# Number of datasets claimed from the queue per round-trip. Keep this small:
+# the prefetched datasets are held, and their leases renewed, while the
+# earlier datasets of the window are being processed.
+PREFETCH_COUNT = 2
+LEASE_SECS = 20
+# Datasets are streamed into the model in chunks of this many rows, so that
+# the memory used by the worker does not grow with the size of a dataset.
+CHUNK_SIZE = 50000
+# Number of datasets trained by all the workers between two averagings of
+# their models into the shared checkpoint. With 0, each dataset continues
+# training the latest checkpoint instead, and concurrent workers overwrite
+# each other's models.
+MIX_EVERY = 4
 
 def main():
     """
     Workload which:
-      1. Claims a filename from a Redis Worker Queue
+      1. Claims a small window of filenames from a Redis Worker Queue
       2. Reads the dataset from the file
       3. Partially trains the model on the dataset
       4. Saves a model checkpoint and generates a report on
-         the performance of the model after the partial training.
+         the performance of the model after the partial training,
+         and shares the update of the model with the other workers
       5. Removes the filename from the Redis Worker Queue
-      6. Repeats 1 through 5 till the Queue is empty
+      6. Repeats 2 through 5 for each filename in the window, then
+         1 through 5 till the Queue is empty
     """
-    q = rediswq.RedisWQ(name="datasets", host=HOST)
+    # Leases are tracked in a sorted set scored by their deadline, so
+    # the lease-reaper sidecar of the Redis Pod finds the expired ones
+    # with a range query. The queue is a sorted set scored by dataset
+    # size (see queue-jobs.sh), and the largest datasets are leased first
+    q = rediswq.RedisWQ(
+        name="datasets",
+        host=HOST,
+        layout=rediswq.LAYOUT_ZSET,
+        weighted=True,
+    )
     print("Worker with sessionID: " + q.sessionID())
     print("Initial queue state: empty=" + str(q.empty()))
-    checkpoint_path = None
-    while not q.empty():
-        # Claim item in Redis Worker Queue
-        item = q.lease(lease_secs=20, block=True, timeout=2)
-        if item is not None:
-            dataset_path = item.decode("utf-8")
-            print("Processing dataset: " + dataset_path)
-            training_dataset_path = FILESTORE_PATH + dataset_path
+    metrics = WorkerMetrics(
+        METRICS_DIR + "worker-{}.jsonl".format(q.sessionID()), q.sessionID()
+    )
+    averager = None
+    if MIX_EVERY:
+        averager = ModelAverager(q, OUTPUT_DIR, mix_every=MIX_EVERY)
+    # Block until datasets are available, or return once the queue is
+    # drained, without polling Redis
+    wait_start = time.perf_counter()
+    while q.wait():
+        lease_start = time.perf_counter()
+        # Claim a window of items in Redis Worker Queue
+        items = q.lease_many(
+            PREFETCH_COUNT, lease_secs=LEASE_SECS, block=False
+        )
+        metrics.record_lease(
+            items,
+            lease_start - wait_start,
+            time.perf_counter() - lease_start,
+        )
+        # Renew the leases while the datasets are processed, so that
+        # long-running datasets are not picked up by other workers
+        with q.keep_alive(items, lease_secs=LEASE_SECS):
+            for item in items:
+                dataset_path = item.decode("utf-8")
+                print("Processing dataset: " + dataset_path)
+                training_dataset_path = FILESTORE_PATH + dataset_path
+                # Seconds spent in each stage of processing the dataset
+                stages = {}
 
-            # Initialize the model training manager class
-            model_trainer = FraudDetectionModelTrainer(
-                training_dataset_path,
-                TESTING_DATASET_PATH,
-                CLASS_LABEL,
-                checkpoint_path=checkpoint_path,
-            )
+                with metrics.timed(stages, "load_checkpoint"):
+                    # Resume from the newest checkpoint saved by any worker
+                    checkpoint_path = checkpoints.latest_checkpoint(
+                        OUTPUT_DIR
+                    )
 
-            # Train model and save checkpoint + report
-            checkpoint_path = model_trainer.train_and_save(OUTPUT_DIR)
-            model_trainer.generate_report(REPORT_PATH)
+                    # Initialize the model training manager class
+                    model_trainer = FraudDetectionModelTrainer(
+                        training_dataset_path,
+                        TESTING_DATASET_PATH,
+                        CLASS_LABEL,
+                        checkpoint_path=checkpoint_path,
+                        chunk_size=CHUNK_SIZE,
+                        incremental_eval=True,
+                    )
 
-            # Remove item from Redis Worker Queue
-            q.complete(item)
-        else:
+                # Train model and save checkpoint + report
+                model_trainer.train_and_save(
+                    OUTPUT_DIR, publish=averager is None
+                )
+                model_trainer.generate_report(REPORT_PATH)
+                # Share the update with the other workers
+                if averager:
+                    with metrics.timed(stages, "publish_update"):
+                        averager.publish(
+                            checkpoint_path,
+                            model_trainer.get_model(),
+                            model_trainer.get_train_samples(),
+                        )
+
+                # Remove item from Redis Worker Queue
+                with metrics.timed(stages, "complete"):
+                    q.complete_many([item])
+
+                # The trainer times reading, training, checkpointing and
+                # reporting itself
+                stages.update(model_trainer.get_timings())
+                metrics.record_item(
+                    dataset_path,
+                    stages,
+                    os.path.getsize(training_dataset_path),
+                )
+        if not items:
             print("Waiting for work")
+        wait_start = time.perf_counter()
 
+    # Average the updates published since the last averaging. The last
+    # worker to exit averages the updates of all the others.
+    if averager:
+        averager.reduce()
+    metrics.close()
     print("Queue empty, exiting")
 
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Structured metrics of the batch worker, written as JSON lines.
+#
+# Each line is a JSON object whose "event" field is one of:
+#   - "lease": a window of items was claimed from the queue, with the
+#     seconds spent waiting for work and leasing it
+#   - "item": an item was processed, with the seconds spent in each stage
+#     and the bytes read
+#   - "summary": written on exit, with the totals of the worker
+#
+# Each worker writes its own file, so that the lines of concurrent workers
+# sharing the file server are not interleaved.
+
+import contextlib
+import json
+import os
+import time
+
+
+class WorkerMetrics(object):
+    """
+    Records the metrics of one worker to the JSON lines file at path.
+    """
+    def __init__(self, path, session_id):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a')
+        self._session = session_id
+        self._started = time.time()
+        self._items = 0
+        self._bytes_read = 0
+        self._stages = {}
+
+    def _write(self, event, **fields):
+        record = {
+            "event": event,
+            "session": self._session,
+            "time": time.time(),
+        }
+        record.update(fields)
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def _add_stages(self, stages):
+        for stage, seconds in stages.items():
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timed(self, stages, stage):
+        """
+        Adds the seconds spent in the with block to stages[stage].
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+    def record_lease(self, items, wait_secs, lease_secs):
+        """
+        Records that the items were leased after waiting wait_secs for work
+        and lease_secs for the lease itself.
+        """
+        self._add_stages({"queue_wait": wait_secs, "lease": lease_secs})
+        self._write(
+            "lease",
+            items=len(items),
+            queue_wait_secs=wait_secs,
+            lease_secs=lease_secs,
+        )
+
+    def record_item(self, item, stages, bytes_read):
+        """
+        Records that item was processed, spending stages[stage] seconds in
+        each stage and reading bytes_read bytes.
+        """
+        self._items += 1
+        self._bytes_read += bytes_read
+        self._add_stages(stages)
+        self._write(
+            "item",
+            item=item,
+            bytes_read=bytes_read,
+            total_secs=sum(stages.values()),
+            stages=stages,
+        )
+
+    def close(self):
+        """
+        Records the summary of the worker, and closes the file.
+        """
+        elapsed = time.time() - self._started
+        self._write(
+            "summary",
+            items=self._items,
+            bytes_read=self._bytes_read,
+            elapsed_secs=elapsed,
+            items_per_sec=self._items / elapsed if elapsed else 0.0,
+            stages=self._stages,
+        )
+        self._file.close()
@@ -12,41 +12,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, g
 import logging
 from logging.config import dictConfig
 import sys
 import os
+import asyncio
+from timeit import default_timer
+from wsgiref.headers import Headers
 from flask_cors import CORS
 import whereami_payload
-# gRPC stuff
-from concurrent import futures
-import multiprocessing
-import grpc
-from grpc_reflection.v1alpha import reflection
-from grpc_health.v1 import health
-from grpc_health.v1 import health_pb2
-from grpc_health.v1 import health_pb2_grpc
-# whereami protobufs
-import whereami_pb2
-import whereami_pb2_grpc
+# gRPC stuff is only imported in gRPC mode, and OpenTelemetry only when
+# tracing is enabled, as they take a while to import and slow down the start
+# of pods which don't use them
+grpc_enabled = os.getenv('GRPC_ENABLED') == "True"
+if grpc_enabled:
+    from concurrent import futures
+    import multiprocessing
+    import grpc
+    from grpc_reflection.v1alpha import reflection
+    from grpc_health.v1 import health
+    from grpc_health.v1 import health_pb2
+    from grpc_health.v1 import health_pb2_grpc
+    # whereami protobufs
+    import whereami_pb2
+    import whereami_pb2_grpc
+    from py_grpc_prometheus.prometheus_server_interceptor import PromServerInterceptor
+# HTTP is served by an asyncio (ASGI) server instead of Flask
+asgi_enabled = os.getenv('ASGI_ENABLED') == "True" and not grpc_enabled
 # Prometheus export setup
 from prometheus_flask_exporter import PrometheusMetrics
-from py_grpc_prometheus.prometheus_server_interceptor import PromServerInterceptor
-from prometheus_client import start_http_server
-# OpenTelemetry setup
-os.environ["OTEL_PYTHON_FLASK_EXCLUDED_URLS"] = "healthz,metrics"  # set exclusions
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry import trace
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
-from opentelemetry.propagate import set_global_textmap
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.propagators.cloud_trace_propagator import (
-    CloudTraceFormatPropagator,
-)
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
+from prometheus_client import start_http_server, make_asgi_app, REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
 
 # set up logging
 dictConfig({
@@ -77,23 +74,60 @@ if os.getenv("TRACE_SAMPLING_RATIO"):
     except:
         logging.warning("Invalid trace ratio provided.")  # invalid value? just keep at 0%
 
+# low-overhead observability: tail-based sampling of traces, one span per
+# request instead of instrumenting Flask and Requests, and request metrics
+# grouped by route
+low_overhead_observability = os.getenv("LOW_OVERHEAD_OBSERVABILITY") == "True"
+
 # if tracing is desired, set up trace provider / exporter
 if trace_sampling_ratio > 0:
     logging.info("Attempting to enable tracing.")
 
-    sampler = TraceIdRatioBased(trace_sampling_ratio)
+    # OpenTelemetry setup
+    os.environ["OTEL_PYTHON_FLASK_EXCLUDED_URLS"] = "healthz,metrics"  # set exclusions
+    from opentelemetry import trace
+    if not low_overhead_observability:
+        from opentelemetry.instrumentation.requests import RequestsInstrumentor
+        from opentelemetry.instrumentation.flask import FlaskInstrumentor
+    from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+    from opentelemetry.propagate import set_global_textmap
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.propagators.cloud_trace_propagator import (
+        CloudTraceFormatPropagator,
+    )
+    from opentelemetry.sdk.trace.sampling import ALWAYS_ON, TraceIdRatioBased
+    import whereami_tracing
+
+    if low_overhead_observability:
+        # every span is recorded, and whole traces are then kept or dropped
+        # by the TailSamplingSpanProcessor below
+        sampler = ALWAYS_ON
+    else:
+        sampler = TraceIdRatioBased(trace_sampling_ratio)
 
     # OTEL setup
     set_global_textmap(CloudTraceFormatPropagator())
 
     tracer_provider = TracerProvider(sampler=sampler)
-    cloud_trace_exporter = CloudTraceSpanExporter()
-    tracer_provider.add_span_processor(
-        # BatchSpanProcessor buffers spans and sends them in batches in a
-        # background thread. The default parameters are sensible, but can be
-        # tweaked to optimize your performance
-        BatchSpanProcessor(cloud_trace_exporter)
-    )
+    if os.getenv("TRACE_EXPORTER") == "none":
+        # spans are processed but not sent anywhere, to benchmark tracing
+        span_exporter = whereami_tracing.DiscardingSpanExporter()
+    else:
+        span_exporter = CloudTraceSpanExporter()
+    # BatchSpanProcessor buffers spans and sends them in batches in a
+    # background thread; spans that don't fit in its queue of
+    # TRACE_QUEUE_SIZE spans are dropped, and counted in the
+    # whereami_trace_spans_dropped_total metric
+    span_processor = whereami_tracing.BoundedBatchSpanProcessor(
+        span_exporter,
+        max_queue_size=whereami_payload.getenv_number('TRACE_QUEUE_SIZE', 2048, int))
+    if low_overhead_observability:
+        # traces with an error or slower than TRACE_LATENCY_THRESHOLD_MS are
+        # always exported, the others at TRACE_SAMPLING_RATIO
+        span_processor = whereami_tracing.TailSamplingSpanProcessor(
+            span_processor, trace_sampling_ratio,
+            whereami_payload.getenv_number('TRACE_LATENCY_THRESHOLD_MS', 1000) / 1000)
+    tracer_provider.add_span_processor(span_processor)
     trace.set_tracer_provider(tracer_provider)
 
     tracer = trace.get_tracer(__name__)
@@ -107,27 +141,146 @@ app = Flask(__name__)
 handler = logging.StreamHandler(sys.stdout)
 app.logger.addHandler(handler)
 #app.logger.propagate = True
-app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
-FlaskInstrumentor().instrument_app(app)
-RequestsInstrumentor().instrument()  # enable tracing for Requests
-app.config['JSON_AS_ASCII'] = False  # otherwise our emojis get hosed
+if trace_sampling_ratio > 0 and low_overhead_observability:
+    whereami_tracing.trace_flask_app(app)
+elif trace_sampling_ratio > 0:
+    FlaskInstrumentor().instrument_app(app)
+    RequestsInstrumentor().instrument()  # enable tracing for Requests
 CORS(app)  # enable CORS
-metrics = PrometheusMetrics(app)  # enable Prom metrics
+if low_overhead_observability or asgi_enabled:
+    # the request metrics are recorded below rather than by PrometheusMetrics,
+    # which only sees the requests served by Flask
+    metrics = PrometheusMetrics(app, export_defaults=False)
+
+    # same metrics as PrometheusMetrics'. With low-overhead observability,
+    # they're grouped by route, e.g. `/<path:path>`, rather than by requested
+    # path, so there's a bounded number of series, each looked up once then
+    # cached
+    if low_overhead_observability:
+        request_group = 'url_rule'
+        request_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+    else:
+        request_group = 'path'
+        request_buckets = Histogram.DEFAULT_BUCKETS
+    request_duration_metric = Histogram(
+        'flask_http_request_duration_seconds',
+        'Flask HTTP request duration in seconds',
+        ('method', request_group, 'status'),
+        buckets=request_buckets)
+    request_total_metric = Counter(
+        'flask_http_request_total',
+        'Total number of HTTP requests',
+        ('method', 'status'))
+    request_exceptions_metric = Counter(
+        'flask_http_request_exceptions_total',
+        'Total number of HTTP requests which resulted in an exception',
+        ('method', 'status'))
+    request_metric_series = {} # (method, route or path, status) -> (duration, total)
+
+    def record_request_metrics(method, group, status, duration):
+        key = (method, group, status)
+        series = request_metric_series.get(key)
+        if series is None:
+            series = request_metric_series[key] = (
+                request_duration_metric.labels(*key),
+                request_total_metric.labels(method, status))
+        series[0].observe(duration)
+        series[1].inc()
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = default_timer()
+
+    @app.after_request
+    def record_flask_request_metrics(response):
+        start_time = g.get('request_start_time')
+        if start_time is None or request.path in ('/healthz', '/metrics'):
+            return response
+        if low_overhead_observability:
+            group = request.url_rule.rule if request.url_rule else ''
+        else:
+            group = request.path
+        record_request_metrics(request.method, group, response.status_code,
+                               default_timer() - start_time)
+        return response
+
+    @app.teardown_request
+    def record_flask_request_exception(exc):
+        if exc is not None and request.path not in ('/healthz', '/metrics'):
+            request_exceptions_metric.labels(request.method, 500).inc()
+
+else:
+    metrics = PrometheusMetrics(app)  # enable Prom metrics
 
 # gRPC setup
 grpc_serving_port = int(os.environ.get('PORT', 9090)) # configurable via `PORT` but default to 9090
-grpc_metrics_port = 8000  # prometheus /metrics
+grpc_metrics_port = int(os.environ.get('METRICS_PORT', 8000))  # prometheus /metrics, configurable via `METRICS_PORT`
+# maximum number of RPCs served at once, further RPCs are rejected with
+# RESOURCE_EXHAUSTED; unlimited in absence of env var
+grpc_max_concurrent_rpcs = whereami_payload.getenv_number('GRPC_MAX_CONCURRENT_RPCS', None, int)
 
 # define Whereami object
 whereami_payload = whereami_payload.WhereamiPayload()
-
-
-# create gRPC class
-class WhereamigRPC(whereami_pb2_grpc.WhereamiServicer):
-
-    def GetPayload(self, request, context):
-        payload = whereami_payload.build_payload(None)
-        return whereami_pb2.WhereamiReply(**payload)
+if trace_sampling_ratio > 0 and (low_overhead_observability or asgi_enabled):
+    # Requests isn't instrumented, and neither is the HTTP client of the
+    # asyncio HTTP service, so the trace context is added to the headers of
+    # HTTP backend calls instead
+    whereami_payload.inject_trace_context = whereami_tracing.inject_trace_context
+
+
+# export the statistics of the HTTP backend connection pools with the other
+# Prometheus metrics, to help size BACKEND_POOL_SIZE in chained deployments;
+# the pool of the Flask app, or the one of the asyncio serving modes once
+# it's created. gRPC backends are called over a single channel each, and
+# aren't reported
+class BackendPoolCollector(object):
+
+    def collect(self):
+        max_size = GaugeMetricFamily(
+            'whereami_backend_pool_max_size',
+            'Maximum number of connections kept per HTTP backend.', labels=['backend'])
+        idle = GaugeMetricFamily(
+            'whereami_backend_pool_idle_connections',
+            'Connections to the HTTP backend waiting to be reused.', labels=['backend'])
+        opened = CounterMetricFamily(
+            'whereami_backend_pool_connections_opened',
+            'Connections opened to the HTTP backend.', labels=['backend'])
+        requests_sent = CounterMetricFamily(
+            'whereami_backend_pool_requests',
+            'Requests sent to the HTTP backend.', labels=['backend'])
+        pool_stats = whereami_payload.http_pool.stats()
+        if whereami_payload.async_clients is not None:
+            pool_stats.update(whereami_payload.async_clients.stats())
+        for backend, stats in pool_stats.items():
+            max_size.add_metric([backend], stats['max_size'])
+            idle.add_metric([backend], stats['idle_connections'])
+            opened.add_metric([backend], stats['connections_opened'])
+            requests_sent.add_metric([backend], stats['requests'])
+        return [max_size, idle, opened, requests_sent]
+
+
+REGISTRY.register(BackendPoolCollector())
+
+
+if grpc_enabled:
+
+    # create gRPC class
+    class WhereamigRPC(whereami_pb2_grpc.WhereamiServicer):
+
+        def GetPayload(self, request, context):
+            payload = whereami_payload.build_payload(
+                None, time_remaining=context.time_remaining())
+            return whereami_pb2.WhereamiReply(**payload)
+
+
+    # asyncio version of the gRPC class, for the grpc.aio server
+    class WhereamigRPCAsync(whereami_pb2_grpc.WhereamiServicer):
+
+        async def GetPayload(self, request, context):
+            # backend calls don't outlive the deadline of this RPC
+            payload = await whereami_payload.build_payload_async(
+                None, time_remaining=context.time_remaining())
+            return whereami_pb2.WhereamiReply(**payload)
 
 
 # if selected will serve gRPC endpoint on port 9090
@@ -138,7 +291,8 @@ def grpc_serve():
     # working on a proper workaround
     server = grpc.server(
         futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()+5),
-        interceptors=(PromServerInterceptor(),))  # interceptor for metrics
+        interceptors=(PromServerInterceptor(),),  # interceptor for metrics
+        maximum_concurrent_rpcs=grpc_max_concurrent_rpcs)
 
     # Add the application servicer to the server.
     whereami_pb2_grpc.add_WhereamiServicer_to_server(WhereamigRPC(), server)
@@ -173,6 +327,49 @@ def grpc_serve():
     server.wait_for_termination()
 
 
+# if selected will serve the gRPC endpoint with grpc.aio: RPCs are served by
+# coroutines on a single event loop, so an RPC waiting on a backend doesn't
+# hold a thread, and chains of services calling each other can't starve a
+# thread pool
+async def grpc_serve_async():
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=grpc_max_concurrent_rpcs)
+
+    # Add the application servicer to the server.
+    whereami_pb2_grpc.add_WhereamiServicer_to_server(WhereamigRPCAsync(), server)
+
+    # Create a health check servicer.
+    health_servicer = health.aio.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+
+    # Create a tuple of all of the services we want to export via reflection.
+    services = tuple(
+        service.full_name
+        for service in whereami_pb2.DESCRIPTOR.services_by_name.values()) + (
+            reflection.SERVICE_NAME, health.SERVICE_NAME)
+
+    # Start an end point to expose metrics at host:$grpc_metrics_port/metrics
+    # (the Prometheus interceptor of the threaded server doesn't support
+    # grpc.aio, so RPC metrics aren't collected)
+    start_http_server(port=grpc_metrics_port)
+
+    # Add the reflection service to the server.
+    reflection.enable_server_reflection(services, server)
+    server.add_insecure_port(host_ip + ':' + str(grpc_serving_port))
+    await server.start()
+
+    # Mark all services as healthy.
+    overall_server_health = ""
+    for service in services + (overall_server_health,):
+        await health_servicer.set(service, health_pb2.HealthCheckResponse.SERVING)
+
+    try:
+        await server.wait_for_termination()
+    finally:
+        if whereami_payload.async_clients is not None:
+            await whereami_payload.async_clients.close()
+
+
 # HTTP heathcheck
 @app.route('/healthz')  # healthcheck endpoint
 @metrics.do_not_track()  # exclude from prom metrics
@@ -187,21 +384,160 @@ def home(path):
 
     payload = whereami_payload.build_payload(request.headers)
 
-    # split the path to see if user wants to read a specific field
-    requested_value = path.split('/')[-1]
-    if requested_value in payload.keys():
+    # JSON or protobuf, encoded by whereami_payload rather than Flask so the
+    # results of HTTP backends can be passed through as they were received
+    body, content_type = whereami_payload.encode_response(
+        payload, path, request.headers.get('Accept'))
+    return Response(body, content_type=content_type, headers={'Vary': 'Accept'})
+
+
+# asyncio HTTP service, serving the same routes and payloads as the Flask app
+# under an ASGI server, with the backend services called concurrently
+metrics_asgi_app = make_asgi_app()
+
+# methods of the routes, and methods allowed by CORS preflight responses, as
+# in the Flask app
+ALLOWED_METHODS = b'GET, HEAD, OPTIONS'
+CORS_ALLOWED_METHODS = b'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'
+
+
+def asgi_cors_headers(request_headers, method):
+    """Returns the CORS headers flask_cors adds to the responses of the Flask
+    app, with its default settings, as (name, value) pairs."""
+
+    origin = request_headers.get('Origin')
+    if origin is None:
+        return [(b'access-control-allow-origin', b'*')]
+    headers = [(b'access-control-allow-origin', origin.encode('latin-1'))]
+    if method == 'OPTIONS' and request_headers.get('Access-Control-Request-Method'):
+        # preflight request
+        headers.append((b'access-control-allow-methods', CORS_ALLOWED_METHODS))
+        requested_headers = request_headers.get('Access-Control-Request-Headers')
+        if requested_headers:
+            # all requested headers are allowed, listed in order
+            requested_headers = ', '.join(sorted(
+                h.strip() for h in requested_headers.split(',') if h.strip()))
+            headers.append((b'access-control-allow-headers',
+                            requested_headers.encode('latin-1')))
+    return headers
+
+
+async def send_asgi_response(send, status, body, content_type, method,
+                             request_headers):
+
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    headers = [
+        (b'content-type', content_type.encode('latin-1')),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ]
+    headers += asgi_cors_headers(request_headers, method)
+    if method == 'OPTIONS' or status == 405:
+        headers.append((b'allow', ALLOWED_METHODS))
+    # responses depend on the Accept header, and on the Origin header once
+    # it's echoed by CORS
+    headers.append((b'vary', b'accept, origin' if 'Origin' in request_headers else b'accept'))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers,
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': b'' if method == 'HEAD' else body,
+    })
+
+
+async def asgi_response(path, method, request_headers):
+    """Returns the status, body and content type of the response to a
+    request of the asyncio HTTP service."""
+
+    if method == 'OPTIONS':
+        return 200, '', 'text/html; charset=utf-8'
+    if method not in ('GET', 'HEAD'):
+        return 405, 'Method Not Allowed', 'text/plain; charset=utf-8'
+    if path == '/healthz':
+        return 200, 'OK', 'text/html; charset=utf-8'
+    payload = await whereami_payload.build_payload_async(request_headers)
+    body, content_type = whereami_payload.encode_response(
+        payload, path, request_headers.get('Accept'))
+    return 200, body, content_type
+
+
+async def asgi_app(scope, receive, send):
+
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if whereami_payload.async_clients is not None:
+                    await whereami_payload.async_clients.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    method = scope['method']
+    if path == '/metrics':
+        return await metrics_asgi_app(scope, receive, send)
+
+    # same header names as Flask's, e.g. `X-Request-Id`
+    request_headers = Headers([
+        (name.decode('latin-1').title(), value.decode('latin-1'))
+        for name, value in scope['headers']])
+    # request metrics are recorded the same way as for the Flask app, and
+    # health checks aren't tracked
+    start_time = default_timer()
+    try:
+        status, body, content_type = await asgi_response(path, method, request_headers)
+    except Exception:
+        request_exceptions_metric.labels(method, 500).inc()
+        raise
+    await send_asgi_response(send, status, body, content_type, method, request_headers)
+    if path == '/healthz':
+        return
+    if low_overhead_observability:
+        group = '' if status == 405 else asgi_route(path)
+    else:
+        group = path
+    record_request_metrics(method, group, status, default_timer() - start_time)
+
+
+def asgi_route(path):
+    """Returns the route of the Flask app serving path."""
+
+    return '/' if path == '/' else '/<path:path>'
 
-        return payload[requested_value]
 
-    return jsonify(payload)
+if trace_sampling_ratio > 0 and asgi_enabled:
+    # the requests are traced as those of the Flask app are, with one server
+    # span each
+    asgi_app = whereami_tracing.trace_asgi_app(asgi_app, asgi_route)
+
 
 if __name__ == '__main__':
 
-    # decision point - HTTP or gRPC?
-    if os.getenv('GRPC_ENABLED') == "True":
+    # decision point - HTTP, asyncio HTTP or gRPC?
+    if grpc_enabled and os.getenv('GRPC_AIO_ENABLED') == "True":
+        logging.info('gRPC (asyncio) server listening on port %s'%(grpc_serving_port))
+        asyncio.run(grpc_serve_async())
+
+    elif grpc_enabled:
         logging.info('gRPC server listening on port %s'%(grpc_serving_port))
         grpc_serve()
 
+    elif asgi_enabled:
+        import uvicorn # only needed by the asyncio HTTP service
+        uvicorn.run(
+            asgi_app,
+            host=host_ip.strip('[]'), # stripping out the brackets if present
+            port=int(os.environ.get('PORT', 8080)),
+            log_config=None) # keep the logging configuration above
+
     else:
         app.run(
             host=host_ip.strip('[]'), # stripping out the brackets if present
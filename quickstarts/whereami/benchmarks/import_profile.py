@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Import-time profile of whereami.
+#
+# Imports app.py in a fresh interpreter per serving mode, with
+# `python -X importtime`, and reports for each mode:
+#   - the total time spent importing the modules app.py depends on
+#   - the modules taking the longest to import, including their own imports
+#
+#   python import_profile.py --modes http grpc tracing --top 15
+#
+# The GCE metadata lookups of app.py are made in a background thread, and
+# are left out of the totals. The tracing mode needs Application Default
+# Credentials. Run it a few times, the first run warms the page cache.
+
+import argparse
+import os
+import subprocess
+import sys
+
+WHEREAMI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# environment of each profiled mode
+MODES = {
+    "http": {},
+    "asgi": {"ASGI_ENABLED": "True"},
+    "grpc": {"GRPC_ENABLED": "True"},
+    "tracing": {"TRACE_SAMPLING_RATIO": "1"},
+}
+
+# imports app without running its servers
+IMPORT_APP = "import app"
+
+
+def profile(mode):
+    """Import app.py in mode and return the (self microseconds, cumulative
+    microseconds, module) of every import, in the order they completed."""
+    env = dict(os.environ, **MODES[mode])
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_APP],
+        cwd=WHEREAMI_DIR, env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(own), int(cumulative), name.rstrip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how long importing whereami takes.")
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of slowest imports listed per mode")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        try:
+            imports = profile(mode)
+        except RuntimeError as e:
+            print("{}: failed: {}".format(mode, e))
+            continue
+        # the own time of app is spent running it, not importing
+        imports = [i for i in imports if i[2].strip() != "app"]
+        total = sum(own for own, _, _ in imports)
+        print("{}: {:.0f} ms importing {} modules".format(
+            mode, total / 1000, len(imports)))
+        slowest = sorted(imports, key=lambda i: i[1], reverse=True)
+        for _, cumulative, name in slowest[:args.top]:
+            print("  {:>9.1f} ms  {}".format(cumulative / 1000, name.strip()))
+
+
+if __name__ == "__main__":
+    main()
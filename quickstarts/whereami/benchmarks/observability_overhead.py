@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Per-request overhead of tracing and request metrics in whereami.
+#
+# Imports app.py in a fresh interpreter for each observability mode and
+# trace sampling ratio, serves requests in-process through the Flask test
+# client, without network or backend calls, and reports the CPU time spent
+# per request, and how much more it is than with tracing disabled:
+#
+#   python observability_overhead.py --ratios 0 0.01 1 --requests 5000
+#
+# Spans are discarded instead of being sent to Cloud Trace, so the cost of
+# exporting them isn't included. Each measurement is repeated, and the
+# fastest repeat is kept, as the others were slowed down by something else.
+
+import argparse
+import os
+import subprocess
+import sys
+
+WHEREAMI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# environment of each observability mode
+MODES = {
+    "default": {},
+    "low-overhead": {"LOW_OVERHEAD_OBSERVABILITY": "True"},
+}
+
+# serves requests with the test client of app, and prints the fastest CPU
+# time per request of the repeats, in microseconds
+SERVE_REQUESTS = """
+import sys
+import time
+import app
+client = app.app.test_client()
+requests, repeats = int(sys.argv[1]), int(sys.argv[2])
+for _ in range(requests // 10):
+    client.get("/")
+best = None
+for _ in range(repeats):
+    start = time.process_time()
+    for _ in range(requests):
+        client.get("/")
+    elapsed = (time.process_time() - start) / requests
+    best = elapsed if best is None else min(best, elapsed)
+print(best * 1e6)
+"""
+
+
+def measure(mode, ratio, requests, repeats):
+    """Return the CPU microseconds per request of mode at ratio."""
+    env = dict(os.environ, **MODES[mode])
+    env.update({
+        "TRACE_SAMPLING_RATIO": str(ratio),
+        "TRACE_EXPORTER": "none",
+    })
+    result = subprocess.run(
+        [sys.executable, "-c", SERVE_REQUESTS, str(requests), str(repeats)],
+        cwd=WHEREAMI_DIR, env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the per-request overhead of whereami tracing "
+                    "and metrics.")
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--ratios", nargs="+", type=float,
+                        default=[0, 0.01, 1])
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="requests per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:<14} {:>7} {:>12} {:>12}".format(
+        "mode", "ratio", "us/request", "overhead us"))
+    for mode in args.modes:
+        untraced = None
+        for ratio in args.ratios:
+            try:
+                us = measure(mode, ratio, args.requests, args.repeats)
+            except RuntimeError as e:
+                print("{:<14} {:>7g} failed: {}".format(mode, ratio, e))
+                continue
+            if ratio == 0:
+                untraced = us
+            print("{:<14} {:>7g} {:>12.1f} {:>12}".format(
+                mode, ratio, us,
+                "n/a" if untraced is None else
+                "{:.1f}".format(us - untraced)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Latency benchmark for whereami.
+#
+# Launches app.py locally, optionally chained to N backend instances of
+# itself (frontend -> hop 1 -> ... -> hop N), drives the frontend at a fixed
+# concurrency (each client sends its next request as soon as it gets a
+# reply), and reports for each serving mode:
+#   - requests/sec
+#   - p50/p99/p99.9 latency
+#   - CPU time used by all the whereami instances per request (Linux only)
+#   - errors
+#
+#   python whereami_benchmark.py --modes http grpc --hops 2 --concurrency 32
+#
+# With --protobuf, the HTTP modes are asked for protobuf responses instead
+# of JSON.
+#
+# With --trace-ratios, each mode is benchmarked at each TRACE_SAMPLING_RATIO,
+# to measure the overhead of tracing. Spans can be discarded instead of sent
+# to Cloud Trace, which needs credentials, and the other environment
+# variables of the instances set with --env:
+#
+#   python whereami_benchmark.py --modes http --trace-ratios 0 0.01 1 \
+#       --env TRACE_EXPORTER=none --env LOW_OVERHEAD_OBSERVABILITY=True
+#
+# Use --json to append the results to a file, to compare runs before and
+# after a change. Outside of GCP, the instances serve without the GCE fields,
+# and keep retrying the metadata server in the background.
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import grpc
+import requests
+
+WHEREAMI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, WHEREAMI_DIR)
+import whereami_pb2  # noqa: E402
+import whereami_pb2_grpc  # noqa: E402
+from grpc_health.v1 import health_pb2, health_pb2_grpc  # noqa: E402
+
+# environment of the instances of each serving mode
+MODES = {
+    "http": {},
+    "asgi": {"ASGI_ENABLED": "True"},
+    "grpc": {"GRPC_ENABLED": "True"},
+    "grpc-aio": {"GRPC_ENABLED": "True", "GRPC_AIO_ENABLED": "True"},
+}
+
+
+def is_grpc(mode):
+    return "GRPC_ENABLED" in MODES[mode]
+
+
+def target(mode, port):
+    """Return the address of the instance listening on port, in the format
+    of BACKEND_SERVICE."""
+    if is_grpc(mode):
+        return "127.0.0.1:{}".format(port)
+    return "http://127.0.0.1:{}".format(port)
+
+
+def wait_ready(mode, port, process, timeout):
+    """Wait for the instance on port to pass its health check."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("instance on port {} exited".format(port))
+        try:
+            if is_grpc(mode):
+                with grpc.insecure_channel(target(mode, port)) as channel:
+                    reply = health_pb2_grpc.HealthStub(channel).Check(
+                        health_pb2.HealthCheckRequest(), timeout=1)
+                if reply.status == health_pb2.HealthCheckResponse.SERVING:
+                    return
+            elif requests.get(target(mode, port) + "/healthz",
+                              timeout=1).ok:
+                return
+        except (grpc.RpcError, requests.RequestException):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("instance on port {} not ready".format(port))
+
+
+def start_chain(mode, hops, base_port, log_dir, timeout, extra_env):
+    """Start a frontend and 'hops' chained backends, with the environment
+    variables of extra_env.
+
+    Returns the instances, frontend first."""
+    instances = []
+    # start from the last backend, which calls nothing
+    for hop in range(hops, -1, -1):
+        port = base_port + 2 * hop
+        env = dict(os.environ, **MODES[mode])
+        env.update(extra_env)
+        env.update({
+            "HOST": "127.0.0.1",
+            "PORT": str(port),
+            "METRICS_PORT": str(port + 1),
+            "METADATA": "hop-{}".format(hop),
+            "BACKEND_ENABLED": str(hop < hops),
+            "BACKEND_SERVICE": target(mode, port + 2),
+        })
+        log = open(os.path.join(log_dir, "{}-{}.log".format(mode, hop)), "w")
+        process = subprocess.Popen(
+            [sys.executable, "app.py"], cwd=WHEREAMI_DIR, env=env,
+            stdout=log, stderr=subprocess.STDOUT)
+        instances.append((process, port, log))
+    for process, port, log in instances:
+        try:
+            wait_ready(mode, port, process, timeout)
+        except RuntimeError as e:
+            stop_chain(instances)
+            # show the log of the instance which failed
+            with open(log.name) as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError("{}, log:\n{}".format(e, tail))
+    return instances[::-1]
+
+
+def stop_chain(instances):
+    for process, _, log in instances:
+        process.terminate()
+        process.wait()
+        log.close()
+
+
+def cpu_seconds(pids):
+    """Return the CPU time used so far by the processes, or None if it
+    can't be measured on this platform."""
+    try:
+        total = 0
+        for pid in pids:
+            with open("/proc/{}/stat".format(pid)) as f:
+                # utime and stime, after the parenthesized command name
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        return total / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+def client(mode, port, protobuf, start, end, latencies, errors):
+    """Send requests one after the other until 'end', recording the
+    latencies of the requests sent after 'start'."""
+    if is_grpc(mode):
+        channel = grpc.insecure_channel(target(mode, port))
+        stub = whereami_pb2_grpc.WhereamiStub(channel)
+
+        def call():
+            stub.GetPayload(whereami_pb2.Empty(), timeout=30)
+    else:
+        session = requests.Session()
+        if protobuf:
+            session.headers["Accept"] = "application/x-protobuf"
+        url = target(mode, port) + "/"
+
+        def call():
+            session.get(url, timeout=30).raise_for_status()
+
+    while True:
+        sent = time.time()
+        if sent >= end:
+            break
+        t = time.perf_counter()
+        try:
+            call()
+        except (grpc.RpcError, requests.RequestException):
+            if sent >= start:
+                errors.append(sent)
+            continue
+        if sent >= start:
+            latencies.append(time.perf_counter() - t)
+
+
+def drive(mode, port, protobuf, threads, start, end, results):
+    """Run 'threads' clients in this process."""
+    latencies, errors = [], []
+    clients = [
+        threading.Thread(target=client,
+                         args=(mode, port, protobuf, start, end, latencies,
+                               errors))
+        for _ in range(threads)
+    ]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    results.put((latencies, len(errors)))
+
+
+def percentile(values, q):
+    """Return the q-th percentile of sorted 'values'."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def benchmark(mode, args, log_dir, extra_env):
+    """Benchmark one serving mode and return its results."""
+    instances = start_chain(
+        mode, args.hops, args.base_port, log_dir, args.startup_timeout,
+        extra_env)
+    try:
+        frontend_port = instances[0][1]
+        start = time.time() + args.warmup
+        end = start + args.duration
+        # the clients are spread over processes, so that the load generator
+        # isn't bound by a single interpreter
+        processes = max(1, min(args.processes, args.concurrency))
+        results = multiprocessing.Queue()
+        drivers = [
+            multiprocessing.Process(
+                target=drive,
+                args=(mode, frontend_port, args.protobuf,
+                      args.concurrency // processes
+                      + (i < args.concurrency % processes),
+                      start, end, results))
+            for i in range(processes)
+        ]
+        for d in drivers:
+            d.start()
+        pids = [process.pid for process, _, _ in instances]
+        time.sleep(max(0, start - time.time()))
+        cpu_start = cpu_seconds(pids)
+        time.sleep(max(0, end - time.time()))
+        cpu_end = cpu_seconds(pids)
+        collected = [results.get() for _ in drivers]
+        for d in drivers:
+            d.join()
+    finally:
+        stop_chain(instances)
+
+    latencies = sorted(l for c in collected for l in c[0])
+    completed = len(latencies)
+    cpu = None
+    if cpu_start is not None and cpu_end is not None and completed:
+        cpu = (cpu_end - cpu_start) / completed
+    return {
+        "mode": mode,
+        "hops": args.hops,
+        "concurrency": args.concurrency,
+        "protobuf": args.protobuf,
+        "env": extra_env,
+        "duration": args.duration,
+        "requests": completed,
+        "errors": sum(c[1] for c in collected),
+        "rps": completed / args.duration,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "p999_ms": percentile(latencies, 99.9) * 1000,
+        "cpu_ms_per_request": cpu * 1000 if cpu is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure whereami latency and throughput locally.")
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MODES), default=["http", "grpc"])
+    parser.add_argument(
+        "--hops", type=int, default=0,
+        help="number of backend instances chained behind the frontend")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--protobuf", action="store_true",
+                        help="ask the HTTP modes for protobuf responses")
+    parser.add_argument("--duration", type=float, default=20,
+                        help="seconds measured, after the warmup")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--processes", type=int,
+                        default=max(1, multiprocessing.cpu_count() // 2),
+                        help="load generator processes")
+    parser.add_argument("--base-port", type=int, default=18080)
+    parser.add_argument("--startup-timeout", type=float, default=90)
+    parser.add_argument("--trace-ratios", nargs="+", type=float,
+                        help="benchmark each mode at these trace sampling "
+                             "ratios")
+    parser.add_argument("--env", action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="environment variable of the instances")
+    parser.add_argument("--json", help="append the results to this file")
+    args = parser.parse_args()
+
+    runs = []
+    for mode in args.modes:
+        for ratio in args.trace_ratios or [None]:
+            extra_env = dict(e.split("=", 1) for e in args.env)
+            name = mode
+            if ratio is not None:
+                extra_env["TRACE_SAMPLING_RATIO"] = str(ratio)
+                name = "{}@{:g}".format(mode, ratio)
+            runs.append((name, mode, extra_env))
+
+    print("{} hops, concurrency {}, {}s per mode".format(
+        args.hops, args.concurrency, args.duration))
+    print("{:<14} {:>9} {:>9} {:>9} {:>9} {:>12} {:>7}".format(
+        "mode", "req/s", "p50 ms", "p99 ms", "p99.9 ms", "cpu ms/req",
+        "errors"))
+    with tempfile.TemporaryDirectory() as log_dir:
+        for name, mode, extra_env in runs:
+            try:
+                result = benchmark(mode, args, log_dir, extra_env)
+            except RuntimeError as e:
+                print("{:<14} failed: {}".format(name, e))
+                continue
+            cpu = result["cpu_ms_per_request"]
+            print("{:<14} {:>9.0f} {:>9.2f} {:>9.2f} {:>9.2f} {:>12} {:>7}"
+                  .format(name, result["rps"], result["p50_ms"],
+                          result["p99_ms"], result["p999_ms"],
+                          "n/a" if cpu is None else "{:.2f}".format(cpu),
+                          result["errors"]))
+            if args.json:
+                result["time"] = time.time()
+                with open(args.json, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
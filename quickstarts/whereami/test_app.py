@@ -0,0 +1,170 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+os.environ['ASGI_ENABLED'] = 'True'
+os.environ.pop('LOW_OVERHEAD_OBSERVABILITY', None)
+import app
+import whereami_tracing
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import SpanKind
+from prometheus_client import REGISTRY
+
+
+def asgi_request(method, path, headers=(), asgi_app=None):
+    """Serves a request with asgi_app, app.asgi_app by default, and returns
+    the response status and headers."""
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path,
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run((asgi_app or app.asgi_app)(scope, receive, send))
+    return messages[0]['status'], {
+        k.decode(): v.decode() for k, v in messages[0]['headers']}
+
+
+def flask_request(method, path, headers=()):
+    response = app.app.test_client().open(
+        path, method=method, headers=list(headers))
+    return response.status_code, {
+        k.lower(): v for k, v in response.headers.items()}
+
+
+class TestAsgiApp(unittest.TestCase):
+
+    CORS_HEADERS = ('access-control-allow-origin',
+                    'access-control-allow-methods',
+                    'access-control-allow-headers')
+
+    def assertSameCors(self, method, path, headers):
+        asgi_status, asgi_headers = asgi_request(method, path, headers)
+        flask_status, flask_headers = flask_request(method, path, headers)
+        self.assertEqual(asgi_status, flask_status)
+        for name in self.CORS_HEADERS:
+            self.assertEqual(
+                asgi_headers.get(name), flask_headers.get(name), name)
+
+    def test_preflight_cors_headers(self):
+        self.assertSameCors('OPTIONS', '/', [
+            ('Origin', 'https://example.com'),
+            ('Access-Control-Request-Method', 'GET'),
+            ('Access-Control-Request-Headers', 'X-Custom, Content-Type')])
+
+    def test_options_without_origin(self):
+        self.assertSameCors('OPTIONS', '/', [])
+
+    def test_options_without_preflight(self):
+        self.assertSameCors(
+            'OPTIONS', '/healthz', [('Origin', 'https://example.com')])
+
+    def test_method_not_allowed(self):
+        status, headers = asgi_request('POST', '/')
+        self.assertEqual(status, 405)
+        self.assertEqual(headers['allow'], 'GET, HEAD, OPTIONS')
+
+    def test_request_metrics(self):
+        labels = {'method': 'OPTIONS', 'path': '/zone', 'status': '200'}
+        before = REGISTRY.get_sample_value(
+            'flask_http_request_duration_seconds_count', labels) or 0
+        asgi_request('OPTIONS', '/zone')
+        self.assertEqual(REGISTRY.get_sample_value(
+            'flask_http_request_duration_seconds_count', labels), before + 1)
+        self.assertIsNotNone(REGISTRY.get_sample_value(
+            'flask_http_request_total',
+            {'method': 'OPTIONS', 'status': '200'}))
+
+    def test_async_backend_pool_metrics(self):
+        stats = {'http://backend:80': {
+            'max_size': 10, 'idle_connections': 2, 'connections_opened': 3,
+            'requests': 5}}
+        with mock.patch.object(app.whereami_payload, 'async_clients',
+                               mock.Mock(**{'stats.return_value': stats})):
+            self.assertEqual(REGISTRY.get_sample_value(
+                'whereami_backend_pool_requests_total',
+                {'backend': 'http://backend:80'}), 5)
+            self.assertEqual(REGISTRY.get_sample_value(
+                'whereami_backend_pool_idle_connections',
+                {'backend': 'http://backend:80'}), 2)
+
+    def test_health_checks_are_not_tracked(self):
+        asgi_request('GET', '/healthz')
+        self.assertIsNone(REGISTRY.get_sample_value(
+            'flask_http_request_total', {'method': 'GET', 'status': '200'}))
+
+
+class TestAsgiTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        get_tracer = mock.patch.object(
+            whereami_tracing.trace, 'get_tracer', provider.get_tracer)
+        get_tracer.start()
+        self.addCleanup(get_tracer.stop)
+
+    def test_server_spans(self):
+        traced_app = whereami_tracing.trace_asgi_app(
+            app.asgi_app, app.asgi_route)
+        asgi_request('OPTIONS', '/zone', asgi_app=traced_app)
+        asgi_request('POST', '/', asgi_app=traced_app)
+        asgi_request('GET', '/healthz', asgi_app=traced_app)
+        zone, post = self.exporter.get_finished_spans()
+        self.assertEqual(zone.name, 'OPTIONS /<path:path>')
+        self.assertEqual(zone.kind, SpanKind.SERVER)
+        self.assertEqual(zone.attributes['http.route'], '/<path:path>')
+        self.assertEqual(zone.attributes['http.response.status_code'], 200)
+        self.assertEqual(post.name, 'POST /')
+        self.assertEqual(post.attributes['http.response.status_code'], 405)
+
+    def test_trace_context_is_propagated(self):
+        backend_headers = {}
+
+        async def backend_calling_app(scope, receive, send):
+            whereami_tracing.inject_trace_context(backend_headers)
+            await app.asgi_app(scope, receive, send)
+
+        traced_app = whereami_tracing.trace_asgi_app(
+            backend_calling_app, app.asgi_route)
+        trace_id = '0af7651916cd43dd8448eb211c80319c'
+        asgi_request('OPTIONS', '/', [
+            ('traceparent', '00-%s-b7ad6b7169203331-01' % trace_id)],
+            asgi_app=traced_app)
+        span, = self.exporter.get_finished_spans()
+        self.assertEqual(format(span.context.trace_id, '032x'), trace_id)
+        self.assertEqual(span.parent.span_id, 0xb7ad6b7169203331)
+        # the backend call continues the trace from the server span
+        self.assertEqual(
+            backend_headers['traceparent'],
+            '00-%s-%016x-01' % (trace_id, span.context.span_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
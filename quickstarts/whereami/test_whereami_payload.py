@@ -0,0 +1,217 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import whereami_payload
+
+GCE_FIELDS = {'project_id': 'my-project', 'zone': 'us-central1-a'}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestGceMetadata(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            whereami_payload, METADATA_RETRY_MIN_SECS=0.01,
+            METADATA_RETRY_MAX_SECS=0.04)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.cache_path = os.path.join(self.dir.name, 'gce-metadata.json')
+
+    def payload(self, fetched):
+        """Returns a WhereamiPayload whose metadata fetches return the values
+        of fetched, then GCE_FIELDS."""
+        fetch = mock.patch.object(
+            whereami_payload.WhereamiPayload, 'fetch_gce_metadata',
+            side_effect=list(fetched) + [GCE_FIELDS] * 100)
+        env = mock.patch.dict(
+            os.environ, {'METADATA_CACHE_PATH': self.cache_path})
+        with env:
+            self.fetch = fetch.start()
+            self.addCleanup(fetch.stop)
+            payload = whereami_payload.WhereamiPayload()
+        self.addCleanup(payload.metadata_stopped.set)
+        return payload
+
+    def test_failed_fetch_is_retried(self):
+        payload = self.payload([None, None, None])
+        # The fields are saved to the cache last
+        self.assertTrue(wait_for(lambda: whereami_payload.load_gce_fields(
+            self.cache_path) == GCE_FIELDS))
+        self.assertEqual(self.fetch.call_count, 4)
+        self.assertEqual(payload.gce_fields, GCE_FIELDS)
+        self.assertEqual(payload.static_payload['zone'], 'us-central1-a')
+
+    def test_cache_hit_is_refreshed(self):
+        whereami_payload.save_gce_fields(
+            self.cache_path, dict(GCE_FIELDS, zone='europe-west1-b'))
+        payload = self.payload([])
+        self.assertTrue(wait_for(lambda: whereami_payload.load_gce_fields(
+            self.cache_path) == GCE_FIELDS))
+        self.assertEqual(payload.static_payload['zone'], 'us-central1-a')
+        self.assertEqual(list(payload.static_payload)[:2], list(GCE_FIELDS))
+
+    def test_pod_name_emoji(self):
+        emojis = set()
+        for pod_name in ('whereami-7d9f8-abcde', 'whereami-7d9f8-fghij'):
+            with mock.patch.object(whereami_payload.socket, 'gethostname',
+                                   return_value=pod_name):
+                emojis.add(self.payload([]).static_payload['pod_name_emoji'])
+                # The same pod name always gets the same emoji
+                self.assertIn(
+                    self.payload([]).static_payload['pod_name_emoji'], emojis)
+        self.assertEqual(len(emojis), 2)
+        self.assertTrue(emojis <= set(whereami_payload.POD_NAME_EMOJI))
+
+
+class TestEncodeResponse(unittest.TestCase):
+
+    ACCEPT = whereami_payload.PROTOBUF_MEDIA_TYPE
+
+    def setUp(self):
+        fetch = mock.patch.object(
+            whereami_payload.WhereamiPayload, 'fetch_gce_metadata',
+            return_value=GCE_FIELDS)
+        fetch.start()
+        self.addCleanup(fetch.stop)
+        with mock.patch.dict(os.environ, {'ECHO_HEADERS': 'True'}):
+            self.whereami_payload = whereami_payload.WhereamiPayload()
+        self.addCleanup(self.whereami_payload.metadata_stopped.set)
+        self.payload = self.whereami_payload.start_payload(
+            {'host': 'whereami'})
+
+    def encode(self, path):
+        return self.whereami_payload.encode_response(
+            self.payload, path, self.ACCEPT)
+
+    def assertJson(self, path, value):
+        body, content_type = self.encode(path)
+        self.assertEqual(content_type, whereami_payload.JSON_MEDIA_TYPE)
+        self.assertEqual(json.loads(body), value)
+
+    def test_missing_backend_result(self):
+        self.payload['backend_result'] = None
+        self.assertJson('backend_result', None)
+
+    def test_several_backend_results(self):
+        self.payload['backend_result'] = [{'zone': 'a'}, {'zone': 'b'}]
+        self.assertJson('backend_result', [{'zone': 'a'}, {'zone': 'b'}])
+
+    def test_headers(self):
+        self.assertJson('headers', {'host': 'whereami'})
+
+    def test_backend_result(self):
+        self.payload['backend_result'] = {'zone': 'a'}
+        body, content_type = self.encode('backend_result')
+        self.assertEqual(content_type, whereami_payload.PROTOBUF_MEDIA_TYPE)
+        self.assertEqual(body, whereami_payload.encode_protobuf({'zone': 'a'}))
+
+
+class TestReadBackendResponse(unittest.TestCase):
+
+    def encode(self, content_type, body):
+        backend_result = whereami_payload.read_backend_response(
+            content_type, body)
+        return json.loads(whereami_payload.encode_json(
+            {'zone': 'a', 'backend_result': backend_result}))
+
+    def test_json_object_is_passed_through(self):
+        backend_result = whereami_payload.read_backend_response(
+            'application/json; charset=utf-8', b' {"zone":"b"}\n')
+        self.assertIsInstance(backend_result,
+                              whereami_payload.RawBackendResult)
+        self.assertEqual(backend_result.body, b'{"zone":"b"}')
+        self.assertEqual(
+            self.encode('application/json', b'{"zone":"b"}'),
+            {'zone': 'a', 'backend_result': {'zone': 'b'}})
+
+    def test_empty_body(self):
+        for content_type in ('application/json', None):
+            with self.subTest(content_type=content_type):
+                self.assertEqual(self.encode(content_type, b' \n'),
+                                 {'zone': 'a', 'backend_result': None})
+
+    def test_non_json_body(self):
+        for body in (b'<html><body>502 Bad Gateway</body></html>',
+                     b'"ok"', b'[{"zone":"b"}]'):
+            with self.subTest(body=body):
+                self.assertEqual(self.encode('application/json', body),
+                                 {'zone': 'a', 'backend_result': None})
+
+
+class BackendHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1' # keep connections alive
+
+    def do_GET(self):
+        body = json.dumps({'zone': 'a'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncBackendClients(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), BackendHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%s/' % self.server.server_port
+
+    def test_pool_stats(self):
+        async def call_backend():
+            clients = whereami_payload.AsyncBackendClients(pool_size=4)
+            for _ in range(3):
+                result = await clients.call_http_backend(self.url, {})
+                self.assertEqual(result.decode(), {'zone': 'a'})
+            stats = clients.stats()
+            await clients.close()
+            return stats
+
+        stats = asyncio.run(call_backend())
+        self.assertEqual(stats, {
+            'http://127.0.0.1:%s' % self.server.server_port: {
+                'max_size': 4,
+                'idle_connections': 1,
+                'connections_opened': 1,
+                'requests': 3,
+            }})
+
+
+if __name__ == '__main__':
+    unittest.main()
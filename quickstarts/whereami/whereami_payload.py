@@ -1,23 +1,58 @@
 import sys
+import asyncio
+import json
 import socket
 import os
+import tempfile
+import threading
+import zlib
 from datetime import datetime
-import emoji
+from types import MappingProxyType
 import logging
 from logging.config import dictConfig
 import requests
 from requests.adapters import HTTPAdapter
 import urllib3
 from urllib3 import Retry
-# gRPC stuff
-import grpc
+# gRPC stuff is imported by import_grpc(), only when used
 from six import b
-import whereami_pb2
-import whereami_pb2_grpc
 
 METADATA_URL = 'http://metadata.google.internal/computeMetadata/v1/'
 METADATA_HEADERS = {'Metadata-Flavor': 'Google'}
+# the GCE metadata is fetched again this often, in seconds, in case it
+# changed; failed fetches are retried after METADATA_RETRY_MIN_SECS, doubling
+# up to METADATA_RETRY_MAX_SECS between attempts
+METADATA_REFRESH_SECS = 600
+METADATA_RETRY_MIN_SECS = 1
+METADATA_RETRY_MAX_SECS = 300
+METADATA_TIMEOUT = 5 # seconds
 GRPC_SECURE_PORTS = ['443', '8443'] # when using gRPC, this list is checked when determining to use a secure or insecure channel
+GRPC_CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 30000), # ping idle connections so dead backends are detected
+    ('grpc.keepalive_timeout_ms', 10000),
+]
+# names of the channel states after which a cached channel is replaced by a
+# new one
+GRPC_FAILED_STATES = ('TRANSIENT_FAILURE', 'SHUTDOWN')
+# media types of the HTTP responses; JSON unless the client asks for a
+# protobuf encoded WhereamiReply in its Accept header
+JSON_MEDIA_TYPE = 'application/json'
+PROTOBUF_MEDIA_TYPE = 'application/x-protobuf'
+PROTOBUF_MEDIA_TYPES = (PROTOBUF_MEDIA_TYPE, 'application/protobuf')
+TEXT_CONTENT_TYPE = 'text/html; charset=utf-8'
+
+# emoji of the pods, one per pod name: the single code point emoji from
+# U+1F400 to U+1F4FF (animals, people, hearts and objects), rather than the
+# whole emoji package, which takes longer to import than the rest of the
+# payload module
+POD_NAME_EMOJI = (
+    '🐀🐁🐂🐃🐄🐅🐆🐇🐈🐉🐊🐋🐌🐍🐎🐏🐐🐑🐒🐓🐔🐕🐖🐗🐘🐙🐚🐛🐜🐝🐞🐟🐠🐡🐢🐣'
+    '🐤🐥🐦🐧🐨🐩🐪🐫🐬🐭🐮🐯🐰🐱🐲🐳🐴🐵🐶🐷🐸🐹🐺🐻🐼🐽🐾👀👂👃👄👅👆👇👈👉'
+    '👊👋👌👍👎👏👐👑👒👓👔👕👖👗👘👙👚👛👜👝👞👟👠👡👢👣👤👥👦👧👨👩👪👫👬👭'
+    '👮👯👰👱👲👳👴👵👶👷👸👹👺👻👼👽👾👿💀💁💂💃💄💅💆💇💈💉💊💋💌💍💎💏💐💑'
+    '💒💓💔💕💖💗💘💙💚💛💜💝💞💟💠💡💢💣💤💥💦💧💨💩💪💫💬💭💮💯💰💱💲💳💴💵'
+    '💶💷💸💹💺💻💼💽💾💿📀📁📂📃📄📅📆📇📈📉📊📋📌📍📎📏📐📑📒📓📔📕📖📗📘📙'
+    '📚📛📜📝📞📟📠📡📢📣📤📥📦📧📨📩📪📫📬📭📮📯📰📱📲📳📴📵📶📷📸📹📺📻📼📿')
 
 # set up logging
 dictConfig({
@@ -36,197 +71,885 @@ dictConfig({
     }
 })
 
-# set up emoji list
-emoji_list = list(emoji.EMOJI_DATA.keys())
 
+def import_grpc():
+    """Imports the gRPC modules into this module. They take a while to import,
+    and aren't needed when whereami neither serves nor calls gRPC."""
 
-class WhereamiPayload(object):
+    global grpc, whereami_pb2, whereami_pb2_grpc
+    import grpc
+    import whereami_pb2
+    import whereami_pb2_grpc
+
+
+class GrpcChannelPool(object):
+    """Caches one gRPC channel, and its stub, per backend target, so that
+    backend calls reuse established HTTP/2 connections instead of opening a
+    new channel per request."""
 
     def __init__(self):
 
-        self.payload = {}
-        self.gce_metadata = {} # this will cache the results from calling GCE metadata
+        self._lock = threading.Lock()
+        self._channels = {} # target -> (channel, stub)
+        self._states = {} # channel -> last observed connectivity state
+        self._callbacks = {} # channel -> connectivity callback
 
-        # configure retries for GCE metadata GET
-        # we're doing this because, on GKE, metadata endpoint can take a few seconds to be available
-        # see https://cloud.google.com/kubernetes-engine/docs/how-to/workload-identity#limitations
+    def _new_channel(self, target):
 
-        # everything else
-        session = requests.Session()
-        adapter = HTTPAdapter(max_retries=Retry(connect=3, read=3, other=3, total=3, backoff_factor=5)) #, status_forcelist=[429, 500, 502, 503, 504]))
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
+        import_grpc()
+        # assumes port number is appended to target name
+        if target.split(':')[1] in GRPC_SECURE_PORTS:
+            logging.info("Opening gRPC secure channel to %s.", target)
+            channel = grpc.secure_channel(
+                target, grpc.ssl_channel_credentials(),
+                options=GRPC_CHANNEL_OPTIONS)
+        else:
+            logging.info("Opening gRPC insecure channel to %s.", target)
+            channel = grpc.insecure_channel(
+                target, options=GRPC_CHANNEL_OPTIONS)
+
+        # track the connectivity of the channel, so a failed channel can be
+        # replaced on the next request
+        def on_state_change(state):
+            self._states[channel] = state.name
+
+        self._callbacks[channel] = on_state_change
+        channel.subscribe(on_state_change, try_to_connect=True)
+        return channel
+
+    def get_stub(self, target):
+        """Returns the stub of the cached channel to target, opening a new
+        channel if there is none or if the cached one has failed."""
+
+        entry = self._channels.get(target)
+        if entry is None or self._states.get(entry[0]) in GRPC_FAILED_STATES:
+            with self._lock:
+                # another thread may have replaced the channel meanwhile
+                current = self._channels.get(target)
+                if current is entry:
+                    channel = self._new_channel(target)
+                    self._channels[target] = (
+                        channel, whereami_pb2_grpc.WhereamiStub(channel))
+                    if entry is not None:
+                        self._close(entry[0])
+                entry = self._channels[target]
+        return entry[1]
+
+    def discard(self, target, stub):
+        """Closes the channel of stub if it's still the cached channel to
+        target, so the next request reconnects."""
+
+        with self._lock:
+            entry = self._channels.get(target)
+            if entry is not None and entry[1] is stub:
+                del self._channels[target]
+                self._close(entry[0])
+
+    def _close(self, channel):
+
+        channel.unsubscribe(self._callbacks.pop(channel))
+        self._states.pop(channel, None)
+        channel.close()
+
+    def close(self):
+        """Closes all the cached channels."""
+
+        with self._lock:
+            for channel, _ in self._channels.values():
+                self._close(channel)
+            self._channels.clear()
+
+
+class HttpBackendPool(object):
+    """Shared HTTP client for backend calls, keeping connections to each
+    backend alive across requests instead of opening one per request."""
+
+    def __init__(self, pool_size=10, timeout=10.0, retries=1):
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        # only retry failures where the request didn't reach the backend, or
+        # where a proxy in between reports the backend as unavailable
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      status=retries, other=0, backoff_factor=0.1,
+                      status_forcelist=[502, 503, 504],
+                      raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_size,
+                                   pool_maxsize=pool_size,
+                                   max_retries=retry)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def get(self, url, headers=None):
+
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+    def stats(self):
+        """Returns the statistics of the connection pool of each backend
+        host, keyed by "scheme://host:port"."""
+
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            stats['%s://%s:%s' % (pool.scheme, pool.host, pool.port)] = {
+                'max_size': pool.pool.maxsize,
+                'idle_connections': idle,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+        return stats
+
+    def close(self):
+
+        self.session.close()
+
+
+class AsyncBackendClients(object):
+    """Pooled HTTP and gRPC clients for backend calls from the asyncio
+    serving modes. Must be created and used from the serving event loop."""
+
+    def __init__(self, pool_size=10, timeout=10.0, retries=1):
+
+        import httpx # only needed by the asyncio serving modes
+
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.transport = httpx.AsyncHTTPTransport(
+            retries=retries, # connection failures only
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size))
+        self.http = httpx.AsyncClient(timeout=timeout, transport=self.transport)
+        self._channels = {} # target -> (channel, stub)
+        # counters of each backend host, keyed by "scheme://host:port" as
+        # in HttpBackendPool.stats()
+        self._http_stats = {}
+        self._http_stats_keys = {} # backend_service -> key
+
+    def get_http_stats(self, backend_service):
+        """Returns the counters of the host of backend_service."""
+
+        key = self._http_stats_keys.get(backend_service)
+        if key is None:
+            import httpcore
+            import httpx
+            url = httpx.URL(backend_service)
+            port = url.port or (443 if url.scheme == 'https' else 80)
+            key = '%s://%s:%s' % (url.scheme, url.host, port)
+            self._http_stats_keys[backend_service] = key
+            self._http_stats.setdefault(key, {
+                'origin': httpcore.Origin(
+                    url.raw_scheme, url.raw_host, port),
+                'connections_opened': 0,
+                'requests': 0,
+            })
+        return self._http_stats[key]
+
+    async def call_http_backend(self, backend_service, forward_headers):
+
+        stats = self.get_http_stats(backend_service)
+        stats['requests'] += 1
+
+        async def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                stats['connections_opened'] += 1
 
         try:
-            # grab info from GCE metadata
-            r = session.get(METADATA_URL + '?recursive=true',
-                                headers=METADATA_HEADERS)
-            if r.ok:
-                logging.info("Successfully accessed GCE metadata endpoint.")
-                self.gce_metadata = r.json()
-        except:
-            logging.warning("Unable to access GCE metadata endpoint.")
+            r = await self.http.get(backend_service, headers=forward_headers,
+                                    extensions={'trace': trace})
+            if r.is_success:
+                backend_result = read_backend_response(
+                    r.headers.get('content-type'), r.content)
+            else:
+                backend_result = None
+        except Exception as e:
+            logging.warning(type(e))
+            backend_result = None
+
+        return backend_result
+
+    def stats(self):
+        """Returns the statistics of the HTTP connection pool for each
+        backend host, as HttpBackendPool.stats() does. The pool is shared by
+        all the backends, so its size is reported for each of them."""
+
+        connections = self.transport._pool.connections
+        stats = {}
+        for key, counters in self._http_stats.items():
+            stats[key] = {
+                'max_size': self.pool_size,
+                'idle_connections': sum(
+                    1 for conn in connections
+                    if conn.is_idle() and
+                    conn.can_handle_request(counters['origin'])),
+                'connections_opened': counters['connections_opened'],
+                'requests': counters['requests'],
+            }
+        return stats
+
+    def get_stub(self, target):
+        """Returns the stub of the cached channel to target, opening a new
+        channel if there is none or if the cached one has failed."""
+
+        import_grpc()
+        entry = self._channels.get(target)
+        if entry is None or entry[0].get_state().name in GRPC_FAILED_STATES:
+            # assumes port number is appended to target name
+            if target.split(':')[1] in GRPC_SECURE_PORTS:
+                channel = grpc.aio.secure_channel(
+                    target, grpc.ssl_channel_credentials(),
+                    options=GRPC_CHANNEL_OPTIONS)
+            else:
+                channel = grpc.aio.insecure_channel(
+                    target, options=GRPC_CHANNEL_OPTIONS)
+            if entry is not None:
+                asyncio.ensure_future(entry[0].close())
+            entry = (channel, whereami_pb2_grpc.WhereamiStub(channel))
+            self._channels[target] = entry
+        return entry[1]
+
+    async def call_grpc_backend(self, backend_service, timeout=None):
+
+        import_grpc()
+        stub = None
+        try:
+            stub = self.get_stub(backend_service)
+            backend_result = await stub.GetPayload(
+                whereami_pb2.Empty(),
+                timeout=self.timeout if timeout is None else timeout)
+
+        except grpc.RpcError as e:
+            backend_result = None
+            logging.warning("Unable to capture backend result: %s", e.code())
+            # drop the channel if the backend is unreachable, so the next
+            # request reconnects (e.g. to a new endpoint)
+            entry = self._channels.get(backend_service)
+            if (e.code() == grpc.StatusCode.UNAVAILABLE and entry is not None
+                    and entry[1] is stub):
+                del self._channels[backend_service]
+                await entry[0].close()
+
+        except Exception:
+            backend_result = None
+            logging.warning("Unable to capture backend result.")
+
+        return backend_result
+
+    async def close(self):
+
+        await self.http.aclose()
+        for channel, _ in self._channels.values():
+            await channel.close()
+        self._channels.clear()
+
+
+# header propagation for HTTP calls to downward services
+# for Istio / Anthos Service Mesh
+def get_forward_headers(request_headers):
+    headers = {}
+    incoming_headers = ['x-request-id',
+                        'x-b3-traceid',
+                        'x-b3-spanid',
+                        'x-b3-parentspanid',
+                        'x-b3-sampled',
+                        'x-b3-flags',
+                        'x-ot-span-context',
+                        'x-cloud-trace-context',
+                        'traceparent',
+                        'grpc-trace-bin'
+                        ]
+
+    for ihdr in incoming_headers:
+        val = request_headers.get(ihdr)
+        if val is not None:
+            headers[ihdr] = val
+
+    return headers
+
+
+class RawBackendResult(object):
+    """The body of a backend's response, kept as it was received, so it can
+    be copied into the response of this service without being decoded and
+    encoded again at every hop of a chain."""
+
+    __slots__ = ('media_type', 'body')
+
+    def __init__(self, media_type, body):
+
+        self.media_type = media_type
+        self.body = body
+
+    def __bool__(self):
+
+        return bool(self.body)
+
+    def decode(self):
+        """Returns the backend result as a dict, as if it had been received
+        as JSON."""
+
+        if self.media_type == PROTOBUF_MEDIA_TYPE:
+            import_grpc()
+            from google.protobuf import json_format
+            return json_format.MessageToDict(
+                whereami_pb2.WhereamiReply.FromString(self.body),
+                preserving_proto_field_name=True)
+        return json.loads(self.body)
+
+
+def read_backend_response(content_type, body):
+    """Returns the result of a backend call, given the Content-Type and the
+    body of the backend's response, or None if the body isn't a JSON
+    object or a WhereamiReply.
+
+    A JSON body is copied as it is into the responses only if it looks like
+    an object; anything else, such as an empty body or an HTML error page
+    sent as JSON by a proxy, would make them invalid JSON."""
+
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if media_type in PROTOBUF_MEDIA_TYPES:
+        return RawBackendResult(PROTOBUF_MEDIA_TYPE, body)
+    body = body.strip()
+    if media_type == JSON_MEDIA_TYPE and body.startswith(b'{'):
+        return RawBackendResult(JSON_MEDIA_TYPE, body)
+    try:
+        backend_result = json.loads(body)
+    except ValueError:
+        logging.warning("Invalid JSON backend response (%s).",
+                        media_type or 'no Content-Type')
+        return None
+    return backend_result if isinstance(backend_result, dict) else None
+
+
+def negotiate_media_type(accept):
+    """Returns the media type of the response to a request with the Accept
+    header accept: protobuf if the client lists it, with at least the
+    quality of JSON, JSON otherwise."""
+
+    if not accept or 'protobuf' not in accept:
+        return JSON_MEDIA_TYPE
+
+    protobuf_q = json_q = 0.0
+    for media_range in accept.split(','):
+        params = media_range.split(';')
+        media_type = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        if media_type in PROTOBUF_MEDIA_TYPES:
+            protobuf_q = max(protobuf_q, q)
+        elif media_type in (JSON_MEDIA_TYPE, 'application/*', '*/*'):
+            json_q = max(json_q, q)
+
+    if protobuf_q > 0 and protobuf_q >= json_q:
+        return PROTOBUF_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def decode_backend_results(value):
+    """Returns value with the raw backend results it holds decoded."""
+
+    if isinstance(value, RawBackendResult):
+        return value.decode()
+    if isinstance(value, list):
+        return [decode_backend_results(v) for v in value]
+    if isinstance(value, dict) and 'backend_result' in value:
+        value = dict(value)
+        value['backend_result'] = decode_backend_results(value['backend_result'])
+    return value
+
+
+def encode_json(value, indent=None):
+    """Returns value encoded as JSON. Unless it's indented, the backend
+    results received as JSON are copied into it as they are."""
+
+    if indent is not None:
+        return json.dumps(decode_backend_results(value), ensure_ascii=False,
+                          sort_keys=True, indent=indent).encode('utf-8')
+
+    if isinstance(value, RawBackendResult):
+        if value.media_type == JSON_MEDIA_TYPE:
+            return value.body
+        return encode_json(value.decode())
+    if isinstance(value, list):
+        return b'[' + b','.join(encode_json(v) for v in value) + b']'
+    if isinstance(value, dict) and 'backend_result' in value:
+        fields = dict(value)
+        backend_result = encode_json(fields.pop('backend_result'))
+        body = encode_json(fields)
+        # insert the backend result before the closing brace
+        return (body[:-1] + (b',' if fields else b'') +
+                b'"backend_result":' + backend_result + b'}')
+    return json.dumps(value, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def encode_varint(value):
+    """Returns the protobuf varint encoding of value."""
+
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_protobuf(value):
+    """Returns value encoded as a WhereamiReply. Fields which aren't in a
+    WhereamiReply are left out, and so are all but the first backend result,
+    as in gRPC mode. A backend result received as protobuf is copied into it
+    as it is."""
+
+    import_grpc()
+    if isinstance(value, RawBackendResult):
+        if value.media_type == PROTOBUF_MEDIA_TYPE:
+            return value.body
+        value = value.decode()
+
+    reply_fields = whereami_pb2.WhereamiReply.DESCRIPTOR.fields_by_name
+    reply = whereami_pb2.WhereamiReply(**{
+        k: v for k, v in value.items()
+        if k in reply_fields and k != 'backend_result'})
+    body = reply.SerializeToString()
+
+    backend_result = value.get('backend_result')
+    if isinstance(backend_result, list):
+        backend_result = next((r for r in backend_result if r), None)
+    if not backend_result:
+        return body
+    backend_result = encode_protobuf(backend_result)
+    # a message field is encoded as its tag (field 1, length-delimited), its
+    # length and the encoded message, and can follow the other fields
+    return body + b'\x0a' + encode_varint(len(backend_result)) + backend_result
+
+
+def get_gce_fields(gce_metadata):
+    """Returns the fields of the payload taken from the response of the GCE
+    metadata endpoint. Only these are kept, as the full response of a node's
+    metadata server can hold credentials."""
+
+    gce_fields = {}
+
+    # get project / zone info
+    gce_fields['project_id'] = gce_metadata['project']['projectId']
+    gce_fields['zone'] = gce_metadata['instance']['zone'].split('/')[-1]
+
+    # if we're running in GKE, we can also get cluster name
+    try:
+        gce_fields['cluster_name'] = gce_metadata['instance']['attributes']['cluster-name']
+    except:
+        logging.warning("Unable to capture GKE cluster name.")
+    # if we're running on Google, grab the instance ID and default Google service account
+    try:
+        gce_fields['gce_instance_id'] = str(gce_metadata['instance']['id']) # casting to str as value can be alphanumeric on Cloud Run
+    except:
+        logging.warning("Unable to capture GCE instance ID.")
+    try:
+        gce_fields['gce_service_account'] = gce_metadata['instance']['serviceAccounts']['default']['email']
+    except:
+        logging.warning("Unable to capture GCE service account.")
+
+    return gce_fields
+
+
+def load_gce_fields(cache_path):
+    """Returns the GCE fields saved to cache_path by save_gce_fields, or None
+    if there are none."""
+
+    try:
+        with open(cache_path) as f:
+            gce_fields = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.warning("Unable to read GCE metadata cache %s.", cache_path)
+        return None
+    if not isinstance(gce_fields, dict) or not gce_fields:
+        return None
+    return gce_fields
+
+
+def save_gce_fields(cache_path, gce_fields):
+    """Saves gce_fields to cache_path. The file is written to a temporary
+    file which is then renamed, so a restarting container never reads a
+    partially written cache."""
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(cache_path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(gce_fields, f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        logging.warning("Unable to write GCE metadata cache %s.", cache_path)
+
+
+def getenv_number(name, default, type_=float):
+    """Returns environment variable name converted by type_, or default if
+    it's unset or invalid."""
+
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return type_(value)
+    except ValueError:
+        logging.warning("Invalid %s provided.", name)
+        return default
 
 
-    def build_payload(self, request_headers):
-
-        # header propagation for HTTP calls to downward services
-        # for Istio / Anthos Service Mesh
-        def getForwardHeaders(request_headers):
-            headers = {}
-            incoming_headers = ['x-request-id',
-                                'x-b3-traceid',
-                                'x-b3-spanid',
-                                'x-b3-parentspanid',
-                                'x-b3-sampled',
-                                'x-b3-flags',
-                                'x-ot-span-context',
-                                'x-cloud-trace-context',
-                                'traceparent',
-                                'grpc-trace-bin'
-                                ]
-
-            for ihdr in incoming_headers:
-                val = request_headers.get(ihdr)
-                if val is not None:
-                    headers[ihdr] = val
-
-            return headers
-
-        # call HTTP backend (expect JSON reesponse)
-        def call_http_backend(backend_service):
-
-            try:
-                r = requests.get(backend_service,
-                                 headers=getForwardHeaders(request_headers))
-                if r.ok:
-                    backend_result = r.json()
-                else:
-                    backend_result = None
-            except:
-
-                logging.warning(sys.exc_info()[0])
-                backend_result = None
+class WhereamiPayload(object):
 
-            return backend_result
-
-        # call gRPC backend
-        def call_grpc_backend(backend_service):
-
-            try:
-                # assumes port number is appended to backend_service name
-                if backend_service.split(':')[1] in GRPC_SECURE_PORTS:
-                    logging.info("Using gRPC secure channel.")
-                    channel = grpc.secure_channel(backend_service, grpc.ssl_channel_credentials())
-                else:
-                    logging.info("Using gRPC insecure channel.")
-                    channel = grpc.insecure_channel(backend_service)
-                
-                stub = whereami_pb2_grpc.WhereamiStub(channel)
-                backend_result = stub.GetPayload(
-                    whereami_pb2.Empty())
-
-            except:
-                backend_result = None
-                logging.warning("Unable to capture backend result.")
-
-            return backend_result
-
-        # grab info from cached GCE metadata
-        if len(self.gce_metadata):
-            logging.info("Found cached GCE metadata.")
-
-            # get project / zone info
-            self.payload['project_id'] = self.gce_metadata['project']['projectId']
-            self.payload['zone'] = self.gce_metadata['instance']['zone'].split('/')[-1]
-
-            # if we're running in GKE, we can also get cluster name
-            try:
-                self.payload['cluster_name'] = self.gce_metadata['instance']['attributes']['cluster-name']
-            except:
-                logging.warning("Unable to capture GKE cluster name.")
-            # if we're running on Google, grab the instance ID and default Google service account
-            try:
-                self.payload['gce_instance_id'] = str(self.gce_metadata['instance']['id']) # casting to str as value can be alphanumeric on Cloud Run
-            except:
-                logging.warning("Unable to capture GCE instance ID.")
-            try:
-                self.payload['gce_service_account'] = self.gce_metadata['instance']['serviceAccounts']['default']['email']
-            except:
-                logging.warning("Unable to capture GCE service account.")
-        else:
-            logging.warning("GCE metadata unavailable.")
+    def __init__(self):
+
+        # the fields of the payload taken from GCE metadata; they're fetched
+        # in the background, so the server starts without waiting for the
+        # metadata endpoint, and saved to METADATA_CACHE_PATH, if set, so a
+        # restarted container starts with them rather than without
+        self.metadata_cache_path = os.getenv('METADATA_CACHE_PATH')
+        self.gce_fields = {}
+        if self.metadata_cache_path:
+            self.gce_fields = load_gce_fields(self.metadata_cache_path) or {}
+            if self.gce_fields:
+                logging.info("Loaded GCE metadata from %s.",
+                             self.metadata_cache_path)
+
+        # the configuration and the fields describing this pod don't change
+        # for the lifetime of the process, so they're read once here
+        self.backend_enabled = os.getenv('BACKEND_ENABLED') == 'True'
+        # several backend services can be listed, separated by commas
+        self.backend_services = [
+            backend_service.strip()
+            for backend_service in os.getenv('BACKEND_SERVICE', '').split(',')
+            if backend_service.strip()]
+        self.grpc_enabled = os.getenv('GRPC_ENABLED') == 'True'
+        self.echo_headers = os.getenv('ECHO_HEADERS') == 'True'
+        # JSON responses are compact, unless PRETTY_JSON is set
+        self.json_indent = 2 if os.getenv('PRETTY_JSON') == 'True' else None
+        # deadline of backend calls, in seconds
+        self.backend_timeout = getenv_number('BACKEND_TIMEOUT', 10.0)
+        self.backend_pool_size = getenv_number('BACKEND_POOL_SIZE', 10, int)
+        self.backend_retries = getenv_number('BACKEND_RETRIES', 1, int)
+        self.grpc_channels = GrpcChannelPool()
+        self.http_pool = HttpBackendPool(
+            pool_size=self.backend_pool_size,
+            timeout=self.backend_timeout,
+            retries=self.backend_retries)
+        self.async_clients = None # created by the first asyncio request
+        # called with the headers of HTTP backend calls, when the trace
+        # context must be added to them
+        self.inject_trace_context = None
+        self.static_payload = self.build_static_payload()
+
+        # the GCE fields are fetched even when they were loaded from the
+        # cache, and then refreshed, by a background thread; set
+        # metadata_stopped to end it
+        self.metadata_stopped = threading.Event()
+        self.metadata_thread = threading.Thread(
+            target=self.refresh_gce_metadata, name='gce-metadata',
+            daemon=True)
+        self.metadata_thread.start()
+
+
+    def fetch_gce_metadata(self):
+        """Returns the GCE fields of the payload, fetched from the GCE
+        metadata endpoint, or None if it's not available."""
+
+        try:
+            # grab info from GCE metadata
+            r = requests.get(METADATA_URL + '?recursive=true',
+                             headers=METADATA_HEADERS,
+                             timeout=METADATA_TIMEOUT)
+            if not r.ok:
+                logging.warning("Unable to access GCE metadata endpoint.")
+                return None
+            return get_gce_fields(r.json())
+        except Exception:
+            logging.warning("Unable to access GCE metadata endpoint.")
+            return None
+
+
+    def refresh_gce_metadata(self):
+        """Fetches the GCE metadata, then keeps its fields in the static
+        payload up to date, until metadata_stopped is set. Runs in the
+        background, while requests are served with the cached GCE fields, or
+        without them.
+
+        On GKE, the metadata endpoint can take a few seconds to be available
+        (see https://cloud.google.com/kubernetes-engine/docs/how-to/workload-identity#limitations),
+        so failed fetches are retried with exponential backoff, for as long
+        as it takes."""
+
+        retry_secs = METADATA_RETRY_MIN_SECS
+        while True:
+            gce_fields = self.fetch_gce_metadata()
+            if gce_fields is None:
+                wait_secs = retry_secs
+                retry_secs = min(retry_secs * 2, METADATA_RETRY_MAX_SECS)
+                logging.info("Retrying GCE metadata in %s seconds.", wait_secs)
+            else:
+                if gce_fields != self.gce_fields:
+                    logging.info("Successfully accessed GCE metadata endpoint.")
+                    self.set_gce_fields(gce_fields)
+                wait_secs = METADATA_REFRESH_SECS
+                retry_secs = METADATA_RETRY_MIN_SECS
+            if self.metadata_stopped.wait(wait_secs):
+                return
+
+
+    def set_gce_fields(self, gce_fields):
+        """Replaces the GCE fields of the static payload with gce_fields, and
+        saves them to the cache."""
+
+        # requests copy whichever static payload is current, so replacing it
+        # needs no lock
+        static_payload = dict(gce_fields)
+        static_payload.update((k, v) for k, v in self.static_payload.items()
+                              if k not in self.gce_fields)
+        self.gce_fields = gce_fields
+        self.static_payload = MappingProxyType(static_payload)
+        if self.metadata_cache_path:
+            save_gce_fields(self.metadata_cache_path, gce_fields)
+
+
+    def build_static_payload(self):
+        """Returns the read-only fields of the payload which don't depend on
+        the request. Missing fields are logged once, here, rather than on
+        every request."""
+
+        # start with the GCE fields, once they're fetched
+        static_payload = dict(self.gce_fields)
+        if not self.gce_fields:
+            logging.info("GCE metadata not available yet.")
 
         # get node name via downward API
         if os.getenv('NODE_NAME'):
-            self.payload['node_name'] = os.getenv('NODE_NAME')
+            static_payload['node_name'] = os.getenv('NODE_NAME')
         else:
             logging.warning("Unable to capture node name.")
 
-        # get host header
-        try:
-            self.payload['host_header'] = request_headers.get('host')
-        except:
-            logging.warning("Unable to capture host header.")
-
-        # get pod name, emoji & datetime
-        self.payload['pod_name'] = socket.gethostname()
-        self.payload['pod_name_emoji'] = emoji_list[hash(
-            socket.gethostname()) % len(emoji_list)]
-        self.payload['timestamp'] = datetime.now().replace(
-            microsecond=0).isoformat()
+        # get pod name & emoji; the emoji is derived from a checksum of the
+        # pod name rather than hash(), which differs between processes
+        pod_name = socket.gethostname()
+        static_payload['pod_name'] = pod_name
+        static_payload['pod_name_emoji'] = POD_NAME_EMOJI[zlib.crc32(
+            pod_name.encode('utf-8')) % len(POD_NAME_EMOJI)]
 
         # get namespace, pod ip, and pod service account via downward API
         if os.getenv('POD_NAMESPACE'):
-            self.payload['pod_namespace'] = os.getenv('POD_NAMESPACE')
+            static_payload['pod_namespace'] = os.getenv('POD_NAMESPACE')
         else:
             logging.warning("Unable to capture pod namespace.")
 
         if os.getenv('POD_IP'):
-            self.payload['pod_ip'] = os.getenv('POD_IP')
+            static_payload['pod_ip'] = os.getenv('POD_IP')
         else:
             logging.warning("Unable to capture pod IP address.")
 
         if os.getenv('POD_SERVICE_ACCOUNT'):
-            self.payload['pod_service_account'] = os.getenv(
+            static_payload['pod_service_account'] = os.getenv(
                 'POD_SERVICE_ACCOUNT')
         else:
             logging.warning("Unable to capture pod KSA.")
 
         # get the whereami METADATA envvar
         if os.getenv('METADATA'):
-            self.payload['metadata'] = os.getenv('METADATA')
+            static_payload['metadata'] = os.getenv('METADATA')
         else:
             logging.warning("Unable to capture metadata environment variable.")
 
-        # should we call a backend service?
-        if os.getenv('BACKEND_ENABLED') == 'True':
+        return MappingProxyType(static_payload)
+
+
+    def start_payload(self, request_headers):
+        """Returns a new payload with the fields which don't depend on the
+        backend."""
+
+        # each request gets its own payload, starting from a copy of the
+        # fields computed at startup, so concurrent requests never share state
+        payload = dict(self.static_payload)
+
+        # get host header (gRPC requests don't have headers)
+        if request_headers is not None:
+            payload['host_header'] = request_headers.get('host')
+
+        # get datetime
+        payload['timestamp'] = datetime.now().replace(
+            microsecond=0).isoformat()
+
+        if self.echo_headers and request_headers is not None:
+
+            payload['headers'] = {k: v for k, v in request_headers.items()}
+
+        return payload
+
+
+    def set_backend_result(self, payload, backend_results):
+        """Adds the results of the backend services, in the order of
+        BACKEND_SERVICE, to payload."""
+
+        if self.grpc_enabled:
+            # a WhereamiReply only has room for one backend result
+            backend_results = [r for r in backend_results if r]
+            if backend_results:
+                payload['backend_result'] = backend_results[0]
+        elif len(backend_results) == 1:
+            payload['backend_result'] = backend_results[0]
+        else:
+            payload['backend_result'] = backend_results
 
-            backend_service = os.getenv('BACKEND_SERVICE')
-            logging.info("Attempting to call %s", backend_service)
 
-            if os.getenv('GRPC_ENABLED') == "True":
+    def encode_response(self, payload, path, accept):
+        """Returns the body and the content type of the HTTP response for
+        path, either the payload or one of its fields, in the format the
+        Accept header asks for. Values which aren't a single WhereamiReply
+        are sent as JSON, whatever the Accept header."""
 
-                backend_result = call_grpc_backend(backend_service)
+        # split the path to see if user wants to read a specific field
+        requested_value = path.split('/')[-1]
+        is_reply = True
+        if requested_value in payload.keys():
+            value = payload[requested_value]
+            if isinstance(value, str):
+                return value.encode('utf-8'), TEXT_CONTENT_TYPE
+            payload = value
+            # of the other fields, only a single backend result is a
+            # WhereamiReply; e.g. the headers, a missing backend result or
+            # those of several backends have no protobuf encoding
+            is_reply = (requested_value == 'backend_result' and
+                        isinstance(value, (dict, RawBackendResult)))
 
-                if backend_result:
+        if is_reply and negotiate_media_type(accept) == PROTOBUF_MEDIA_TYPE:
+            return encode_protobuf(payload), PROTOBUF_MEDIA_TYPE
+        return (encode_json(payload, self.json_indent) + b'\n',
+                JSON_MEDIA_TYPE)
+
+
+    def backend_deadline(self, time_remaining):
+        """Returns the timeout of backend calls made while serving a request
+        which must complete within time_remaining seconds (None if it has
+        no deadline), so deadlines propagate along chains of services."""
+
+        if time_remaining is None:
+            return self.backend_timeout
+        return min(self.backend_timeout, max(time_remaining, 0))
+
+
+    def build_payload(self, request_headers, time_remaining=None):
+
+        payload = self.start_payload(request_headers)
+
+        # should we call a backend service?
+        if self.backend_enabled:
 
-                    self.payload['backend_result'] = backend_result
+            logging.debug("Attempting to call %s", self.backend_services)
 
+            if self.grpc_enabled:
+                timeout = self.backend_deadline(time_remaining)
+                backend_results = [self.call_grpc_backend(backend_service, timeout)
+                                   for backend_service in self.backend_services]
             else:
+                backend_results = [self.call_http_backend(backend_service, request_headers)
+                                   for backend_service in self.backend_services]
+            self.set_backend_result(payload, backend_results)
 
-                self.payload['backend_result'] = call_http_backend(backend_service)
+        return payload
 
-        echo_headers = os.getenv('ECHO_HEADERS')
 
-        if echo_headers == 'True':
+    async def build_payload_async(self, request_headers, time_remaining=None):
+        """Same as build_payload, for the asyncio serving modes. The backend
+        services are called concurrently."""
 
-            try:
+        payload = self.start_payload(request_headers)
 
-                self.payload['headers'] = {k: v for k, v in request_headers.items()}
+        # should we call a backend service?
+        if self.backend_enabled:
+
+            logging.debug("Attempting to call %s", self.backend_services)
+
+            if self.async_clients is None:
+                self.async_clients = AsyncBackendClients(
+                    pool_size=self.backend_pool_size,
+                    timeout=self.backend_timeout,
+                    retries=self.backend_retries)
+
+            if self.grpc_enabled:
+                timeout = self.backend_deadline(time_remaining)
+                calls = [self.async_clients.call_grpc_backend(backend_service, timeout)
+                         for backend_service in self.backend_services]
+            else:
+                forward_headers = get_forward_headers(request_headers)
+                # ask for the format of this response, so the backend's can
+                # be passed through
+                forward_headers['Accept'] = negotiate_media_type(
+                    request_headers.get('Accept'))
+                if self.inject_trace_context is not None:
+                    self.inject_trace_context(forward_headers)
+                calls = [self.async_clients.call_http_backend(backend_service, forward_headers)
+                         for backend_service in self.backend_services]
+            self.set_backend_result(payload, await asyncio.gather(*calls))
+
+        return payload
+
+
+    # call HTTP backend (expect JSON reesponse)
+    def call_http_backend(self, backend_service, request_headers):
+
+        forward_headers = get_forward_headers(request_headers)
+        # ask for the format of this response, so the backend's can be passed
+        # through
+        forward_headers['Accept'] = negotiate_media_type(
+            request_headers.get('Accept'))
+        if self.inject_trace_context is not None:
+            self.inject_trace_context(forward_headers)
+        try:
+            r = self.http_pool.get(backend_service, headers=forward_headers)
+            if r.ok:
+                backend_result = read_backend_response(
+                    r.headers.get('content-type'), r.content)
+            else:
+                backend_result = None
+        except:
+
+            logging.warning(sys.exc_info()[0])
+            backend_result = None
+
+        return backend_result
 
-            except:
 
-                logging.warning("Unable to capture inbound headers.")
+    # call gRPC backend
+    def call_grpc_backend(self, backend_service, timeout=None):
+
+        import_grpc()
+        stub = None
+        try:
+            stub = self.grpc_channels.get_stub(backend_service)
+            backend_result = stub.GetPayload(
+                whereami_pb2.Empty(),
+                timeout=self.backend_timeout if timeout is None else timeout)
+
+        except grpc.RpcError as e:
+            backend_result = None
+            logging.warning("Unable to capture backend result: %s", e.code())
+            # drop the channel if the backend is unreachable, so the next
+            # request reconnects (e.g. to a new endpoint)
+            if e.code() == grpc.StatusCode.UNAVAILABLE:
+                self.grpc_channels.discard(backend_service, stub)
+
+        except:
+            backend_result = None
+            logging.warning("Unable to capture backend result.")
 
-        return self.payload
+        return backend_result
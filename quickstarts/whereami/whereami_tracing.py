@@ -0,0 +1,277 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# span processors keeping the cost of tracing bounded; only imported when
+# tracing is enabled
+
+import logging
+import threading
+from flask import g, request
+from prometheus_client import Counter
+from opentelemetry import context, trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+SPANS_DROPPED = Counter(
+    'whereami_trace_spans_dropped',
+    'Spans dropped before being exported, because the export queue or the '
+    'spans waiting for a tail sampling decision were full.', ['reason'])
+TAIL_SAMPLING_DECISIONS = Counter(
+    'whereami_trace_tail_sampling_decisions',
+    'Traces kept for export or discarded by tail sampling.', ['decision'])
+
+
+def trace_flask_app(app, excluded_paths=('/healthz', '/metrics')):
+    """Traces each request served by app with a server span. Unlike
+    FlaskInstrumentor, only the method, route and status code of requests
+    are recorded, which makes untraced requests much cheaper."""
+
+    tracer = trace.get_tracer(__name__)
+
+    @app.before_request
+    def start_span():
+        if request.path in excluded_paths:
+            return
+        route = request.url_rule.rule if request.url_rule else request.path
+        span = tracer.start_span(
+            request.method + ' ' + route,
+            context=extract(request.headers),
+            kind=SpanKind.SERVER,
+            attributes={'http.request.method': request.method,
+                        'http.route': route})
+        g.trace_span = span
+        g.trace_token = context.attach(trace.set_span_in_context(span))
+
+    @app.after_request
+    def set_span_status(response):
+        span = g.get('trace_span')
+        if span is not None and span.is_recording():
+            span.set_attribute('http.response.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.set_status(Status(StatusCode.ERROR))
+        return response
+
+    @app.teardown_request
+    def end_span(exc):
+        span = g.pop('trace_span', None)
+        if span is None:
+            return
+        if exc is not None:
+            span.set_status(Status(StatusCode.ERROR, str(exc)))
+        span.end()
+        context.detach(g.pop('trace_token'))
+
+
+def trace_asgi_app(app, route, excluded_paths=('/healthz', '/metrics')):
+    """Returns app, an ASGI app, with each HTTP request traced by a server
+    span, as trace_flask_app does for Flask. route(path) returns the route
+    of the requests for path. The span is current while app serves the
+    request, so its context can be added to the headers of backend calls
+    with inject_trace_context."""
+
+    tracer = trace.get_tracer(__name__)
+
+    async def traced_app(scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in excluded_paths:
+            return await app(scope, receive, send)
+        method = scope['method']
+        http_route = route(scope['path'])
+        # ASGI header names are lower case
+        headers = {name.decode('latin-1'): value.decode('latin-1')
+                   for name, value in scope['headers']}
+        span = tracer.start_span(
+            method + ' ' + http_route,
+            context=extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={'http.request.method': method,
+                        'http.route': http_route})
+        token = context.attach(trace.set_span_in_context(span))
+
+        async def send_and_set_span_status(message):
+            if (message['type'] == 'http.response.start' and
+                    span.is_recording()):
+                status = message['status']
+                span.set_attribute('http.response.status_code', status)
+                if status >= 500:
+                    span.set_status(Status(StatusCode.ERROR))
+            await send(message)
+
+        try:
+            await app(scope, receive, send_and_set_span_status)
+        except Exception as exc:
+            span.set_status(Status(StatusCode.ERROR, str(exc)))
+            raise
+        finally:
+            span.end()
+            context.detach(token)
+
+    return traced_app
+
+
+def inject_trace_context(headers):
+    """Adds the trace context of the current span to headers, the headers
+    of a backend call, replacing the one forwarded from the request."""
+
+    carrier = {}
+    inject(carrier)
+    # forwarded headers are lower case
+    headers.update((k.lower(), v) for k, v in carrier.items())
+
+
+class DiscardingSpanExporter(SpanExporter):
+    """Exports spans nowhere, to measure the cost of tracing without that of
+    sending spans to Cloud Trace."""
+
+    def export(self, spans):
+
+        return SpanExportResult.SUCCESS
+
+
+class _DequeueCountingExporter(SpanExporter):
+    """Tells a BoundedBatchSpanProcessor how many of its queued spans its
+    batch processor handed over for export."""
+
+    def __init__(self, exporter, processor):
+
+        self._exporter = exporter
+        self._processor = processor
+
+    def export(self, spans):
+
+        self._processor.dequeued(len(spans))
+        return self._exporter.export(spans)
+
+    def shutdown(self):
+
+        self._exporter.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+
+        return self._exporter.force_flush(timeout_millis)
+
+
+class BoundedBatchSpanProcessor(SpanProcessor):
+    """BatchSpanProcessor which holds at most max_queue_size spans waiting
+    for export, and counts the spans it drops once it's full in
+    whereami_trace_spans_dropped_total rather than dropping them silently."""
+
+    def __init__(self, exporter, max_queue_size=2048):
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._max_queue_size = max_queue_size
+        self._processor = BatchSpanProcessor(
+            _DequeueCountingExporter(exporter, self),
+            max_queue_size=max_queue_size,
+            max_export_batch_size=min(512, max_queue_size))
+
+    def dequeued(self, count):
+
+        with self._lock:
+            self._queued -= count
+
+    def on_end(self, span):
+
+        if not span.context.trace_flags.sampled:
+            return
+        with self._lock:
+            if self._queued >= self._max_queue_size:
+                SPANS_DROPPED.labels('queue_full').inc()
+                return
+            self._queued += 1
+        self._processor.on_end(span)
+
+    def shutdown(self):
+
+        self._processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+
+        return self._processor.force_flush(timeout_millis)
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """Decides whether to export a trace once its local root span (the
+    request served by this instance) has ended, then passes the spans of
+    the kept traces to processor.
+
+    A trace is kept if one of its spans has an error, if its root span took
+    at least latency_threshold seconds, or otherwise with probability ratio.
+    The ratio applies to the trace ID, as with TraceIdRatioBased, so the
+    services of a chain keep the same traces. Other spans wait for their
+    root; at most max_pending_spans of them, any more are dropped."""
+
+    def __init__(self, processor, ratio, latency_threshold,
+                 max_pending_spans=10000):
+
+        self._processor = processor
+        self._bound = TraceIdRatioBased.get_bound_for_rate(ratio)
+        self._latency_threshold_ns = int(latency_threshold * 1e9)
+        self._max_pending_spans = max_pending_spans
+        self._lock = threading.Lock()
+        self._pending = {} # trace ID -> ended spans waiting for their root
+        self._pending_spans = 0
+
+    def on_end(self, span):
+
+        trace_id = span.context.trace_id
+        if span.parent is not None and not span.parent.is_remote:
+            with self._lock:
+                if self._pending_spans >= self._max_pending_spans:
+                    SPANS_DROPPED.labels('pending_full').inc()
+                    return
+                self._pending.setdefault(trace_id, []).append(span)
+                self._pending_spans += 1
+            return
+
+        with self._lock:
+            spans = self._pending.pop(trace_id, [])
+            self._pending_spans -= len(spans)
+        spans.append(span)
+
+        if self.keep(span, spans):
+            TAIL_SAMPLING_DECISIONS.labels('kept').inc()
+            for s in spans:
+                self._processor.on_end(s)
+        else:
+            TAIL_SAMPLING_DECISIONS.labels('discarded').inc()
+
+    def keep(self, root, spans):
+
+        if root.end_time - root.start_time >= self._latency_threshold_ns:
+            return True
+        if any(s.status.status_code is StatusCode.ERROR for s in spans):
+            return True
+        return root.context.trace_id & TraceIdRatioBased.TRACE_ID_LIMIT < self._bound
+
+    def shutdown(self):
+
+        with self._lock:
+            if self._pending_spans:
+                logging.warning("Dropping %d spans waiting for their root span.",
+                                self._pending_spans)
+            self._pending.clear()
+            self._pending_spans = 0
+        self._processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+
+        return self._processor.force_flush(timeout_millis)